@@ -1,23 +1,31 @@
 import time
 import os
+import asyncio
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
 import chainlit as cl
-from azure.ai.agents import AgentsClient
-from azure.identity import DefaultAzureCredential
 
 from utils.utils import (
-    append_message, init_settings, get_llm_details, get_llm_models, get_logger,
+    append_message, init_settings, get_agents_client, get_llm_details, get_llm_models, get_logger,
+    request_start_ns,
 )
 from utils.chats import chat_completion
-from utils.foundry import chat_agent
+from utils.llm_cache import create_llm_cache, cache_key, semantic_namespace
 
 logger = get_logger()
 
+# Upload directory shared by all sessions
+Path(".files").mkdir(parents=True, exist_ok=True)
+
+# Shared LLM response cache (only deterministic, attachment-free requests are cached)
+response_cache = create_llm_cache()
+
 # Allowed users for the FileUploader (optional: empty means everyone)
-ALLOWED_UPLOADER_USERS = os.getenv("ALLOWED_UPLOADER_USERS", "").split(",")
-ALLOWED_UPLOADER_USERS = [email.strip() for email in ALLOWED_UPLOADER_USERS if email.strip()]
+# Stored lowercased in a frozenset for O(1), case-insensitive membership checks
+ALLOWED_UPLOADER_USERS = frozenset(
+    email.strip().lower() for email in os.getenv("ALLOWED_UPLOADER_USERS", "").split(",") if email.strip()
+)
 
 @cl.header_auth_callback
 def header_auth_callback(headers: Dict) -> Optional[cl.User]:
@@ -31,21 +39,24 @@ def header_auth_callback(headers: Dict) -> Optional[cl.User]:
     return None
 
 
+# Chat profiles are built once per process since the model configuration is static
+_chat_profiles: Optional[List[cl.ChatProfile]] = None
+
+
 @cl.set_chat_profiles
 async def chat_profile():
     """Expose chat profiles from configured LLM models."""
-    llm_models = get_llm_models()
-    model_list = [f"{model['model_deployment']}--{model['description']}" for model in llm_models]
-    profiles = []
-    for item in model_list:
-        model_deployment, description = item.split("--", 1)
-        profiles.append(
+    global _chat_profiles
+
+    if _chat_profiles is None:
+        _chat_profiles = [
             cl.ChatProfile(
-                name=model_deployment,
-                markdown_description=description
+                name=model["model_deployment"],
+                markdown_description=model["description"]
             )
-        )
-    return profiles
+            for model in get_llm_models()
+        ]
+    return list(_chat_profiles)
 
 
 # @cl.set_starters
@@ -84,16 +95,16 @@ async def on_chat_resume(thread):
 async def _post_start_init():
     """Shared initialization now called immediately on chat start."""
     try:
-        cl.user_session.set("chat_settings", await init_settings())
-        llm_details = get_llm_details()
+        chat_settings = await init_settings()
+        cl.user_session.set("chat_settings", chat_settings)
+
+        # Fills in model_provider/model_name on the same chat_settings dict
+        llm_details = await asyncio.to_thread(get_llm_details)
 
         # Initialize Foundry thread eagerly if provider is 'foundry' and not yet created
-        if cl.user_session.get("chat_settings").get("model_provider") == "foundry" and not cl.user_session.get("thread_id"):
-            agents_client = AgentsClient(
-                endpoint=llm_details["api_endpoint"],
-                credential=DefaultAzureCredential(),
-            )
-            thread = agents_client.threads.create()
+        if chat_settings.get("model_provider") == "foundry" and not cl.user_session.get("thread_id"):
+            agents_client = get_agents_client(llm_details["api_endpoint"])
+            thread = await asyncio.to_thread(agents_client.threads.create)
             cl.user_session.set("thread_id", thread.id)
             logger.info(f"New thread created, thread ID: {thread.id}")
 
@@ -108,8 +119,6 @@ async def start():
     Initialize the chat session and immediately render the FileUploader
     (consent flow disabled).
     """
-    Path(".files").mkdir(parents=True, exist_ok=True)
-
     # Run init now (no consent gate)
     await _post_start_init()
 
@@ -119,7 +128,7 @@ async def start():
     logger.info(f"user_email={user_email}")
 
     # Should this user see the uploader?
-    show_uploader = (not ALLOWED_UPLOADER_USERS) or (user_email in ALLOWED_UPLOADER_USERS)
+    show_uploader = (not ALLOWED_UPLOADER_USERS) or (bool(user_email) and user_email.lower() in ALLOWED_UPLOADER_USERS)
     logger.info(f"User: {user_email}, Show uploader: {show_uploader}")
 
     # Only send FileUploader if user is allowed
@@ -133,24 +142,72 @@ async def start():
         await fupl_msg.send()
 
 
+async def _generate_response(chat_settings: dict, user_input: str, messages: list) -> str:
+    """
+    Route a request to Foundry or the default chat completion.
+
+    Args:
+        chat_settings: The session's chat settings
+        user_input: The raw user message
+        messages: Full message list including system prompt and history
+
+    Returns:
+        str: The generated response
+    """
+    if chat_settings.get("model_provider") == "foundry":
+        from utils.foundry import chat_agent
+        return await chat_agent(user_input)
+    return await chat_completion(messages)
+
+
 @cl.on_message
 async def main(message: cl.Message):
     """
     Handle user messages and route to Foundry or the default chat completion.
     """
     try:
-        cl.user_session.set("start_time", time.time())
+        request_start_ns.set(time.monotonic_ns())
         user_input = message.content
 
-        # Gather message history (and any uploaded elements)
-        messages = append_message("user", user_input, message.elements)
+        # Gather message history (and any uploaded elements). This builds the prompt
+        # for the LLM call and the assistant reply is appended after it, so the
+        # history writes cannot overlap with generation. Attachments are read and
+        # converted here, so run it off the event loop.
+        messages = await asyncio.to_thread(append_message, "user", user_input, message.elements)
+
+        # Only cache deterministic responses to prompts without attachments. Foundry
+        # is never cached: a cached answer would skip chat_agent, leaving both turns
+        # out of the agent thread that later Foundry turns read their context from.
+        chat_settings = cl.user_session.get("chat_settings", {})
+        use_cache = (
+            chat_settings.get("model_provider") != "foundry"
+            and chat_settings.get("temperature") == 0
+            and not message.elements
+        )
 
-        # Route by provider
-        provider = cl.user_session.get("chat_settings", {}).get("model_provider")
-        if provider == "foundry":
-            full_response = await chat_agent(user_input)
+        if use_cache:
+            chat_profile = cl.user_session.get("chat_profile")
+            key = cache_key(chat_profile, messages)
+            # Paraphrases only match requests with the same instructions and history
+            namespace = semantic_namespace(chat_profile, messages)
+            full_response = await response_cache.get(key, prompt=user_input, namespace=namespace)
+
+            if full_response is None:
+                async def generate_and_cache() -> str:
+                    response = await _generate_response(chat_settings, user_input, messages)
+                    await response_cache.set(key, response, prompt=user_input, namespace=namespace)
+                    return response
+
+                # Identical requests already in flight share a single LLM call
+                full_response, shared = await response_cache.coalesce(key, generate_and_cache)
+            else:
+                shared = True
+
+            # The provider did not render this response, so show it here
+            if shared:
+                await cl.Message(content=full_response, author="agent").send()
         else:
-            full_response = await chat_completion(messages)
+            full_response = await _generate_response(chat_settings, user_input, messages)
 
         # Save assistant message to history
         append_message("assistant", full_response)
@@ -43,18 +43,17 @@ def install_dependencies():
     print("Installing testing dependencies...")
     return run_command([
         sys.executable, "-m", "pip", "install", 
-        "pytest", "pytest-asyncio", "pytest-mock", "pytest-cov"
+        "pytest", "pytest-asyncio", "pytest-mock", "pytest-cov", "pytest-xdist"
     ], "Installing testing dependencies")
 
 
 def run_unit_tests():
-    """Run all unit tests."""
+    """Run all unit tests (in parallel via the pytest-xdist options in pytest.ini)."""
     return run_command([
         sys.executable, "-m", "pytest", 
         "tests/", 
         "-v", 
-        "--tb=short",
-        "-x"  # Stop on first failure
+        "--tb=short"
     ], "Running unit tests")
 
 
@@ -87,7 +86,8 @@ def run_specific_test_file(test_file):
         sys.executable, "-m", "pytest",
         str(test_path),
         "-v",
-        "--tb=short"
+        "--tb=short",
+        "-p", "no:cacheprovider"  # Single-file runs never use --lf/--ff, so skip .pytest_cache writes
     ], f"Running specific test file: {test_file}")
 
 
@@ -130,10 +130,10 @@ def main():
             run_specific_test_file(test_file)
         elif command == "all":
             print("Running comprehensive test suite...")
+            # A single coverage run collects and runs every test, so separate
+            # discovery and unit passes would only repeat the same work
             success = True
             success &= install_dependencies()
-            success &= check_test_discovery()
-            success &= run_unit_tests()
             success &= run_tests_with_coverage()
             
             if success:
@@ -166,7 +166,7 @@ Commands:
     lint        - Run code linting
     discover    - Check test discovery
     file <name> - Run specific test file (e.g., 'file app' or 'file test_app.py')
-    all         - Run comprehensive test suite
+    all         - Install dependencies and run the full suite once with coverage
 
 Examples:
     python run_tests.py install
@@ -3,9 +3,13 @@
 
 import pytest
 import tempfile
-import json
+import orjson
 import os
-from unittest.mock import Mock, AsyncMock
+import operator
+import chainlit as cl
+from collections import ChainMap, namedtuple
+from types import MappingProxyType, SimpleNamespace
+from unittest.mock import Mock, AsyncMock, MagicMock
 from pathlib import Path
 
 
@@ -13,8 +17,38 @@ from pathlib import Path
 # SHARED TEST DATA
 # ============================================================================
 
+def _freeze(value):
+    """Recursively convert dicts to read-only mappings and lists to tuples."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    """
+    Recursively convert frozen test data back into mutable dicts and lists.
+    
+    Use this in tests that need to modify the shared sample data.
+    
+    Args:
+        value: Frozen value (MappingProxyType, tuple or scalar)
+        
+    Returns:
+        A mutable deep copy of the value
+    """
+    if isinstance(value, MappingProxyType):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+
+# Shared data below is frozen so fixtures can hand it out without copying
+
 # Sample LLM model configurations for testing
-SAMPLE_LLM_MODELS = [
+SAMPLE_LLM_MODELS = _freeze([
     {
         "model_deployment": "azure/gpt-4",
         "description": "Azure GPT-4 model for general conversations",
@@ -48,10 +82,10 @@ SAMPLE_LLM_MODELS = [
         "api_endpoint": "https://test3.openai.azure.com",
         "api_version": "2023-05-15"
     }
-]
+])
 
 # Sample chat messages for testing
-SAMPLE_CHAT_MESSAGES = [
+SAMPLE_CHAT_MESSAGES = _freeze([
     {
         "role": "system",
         "content": [{"type": "text", "text": "You are a helpful AI assistant for BSP employees."}]
@@ -64,18 +98,18 @@ SAMPLE_CHAT_MESSAGES = [
         "role": "assistant",
         "content": [{"type": "text", "text": "Of course! I'm here to help with BSP policies and procedures."}]
     }
-]
+])
 
 # Sample chat settings
-SAMPLE_CHAT_SETTINGS = {
+SAMPLE_CHAT_SETTINGS = _freeze({
     "temperature": 0.7,
     "instructions": "You are BSP AI Assistant, an advanced conversational AI model...",
     "model_provider": "azure",
     "model_name": "gpt-4"
-}
+})
 
 # Sample user session data
-SAMPLE_USER_SESSION = {
+SAMPLE_USER_SESSION = _freeze({
     "id": "test-session-123",
     "user": Mock(identifier="test@bsp.gov.ph", metadata={"id": "user123", "role": "admin"}),
     "chat_settings": SAMPLE_CHAT_SETTINGS,
@@ -84,7 +118,7 @@ SAMPLE_USER_SESSION = {
     "thread_id": "thread-abc123",
     "uploaded_files": [],
     "start_time": 1234567880
-}
+})
 
 # Sample file elements for testing file uploads
 SAMPLE_IMAGE_ELEMENT = Mock(
@@ -110,28 +144,200 @@ SAMPLE_PDF_ELEMENT = Mock(
 # PYTEST FIXTURES
 # ============================================================================
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_llm_models():
-    """Fixture providing sample LLM model configurations."""
-    return SAMPLE_LLM_MODELS.copy()
+    """Fixture providing sample LLM model configurations (read-only; use thaw() to modify)."""
+    return SAMPLE_LLM_MODELS
 
 
 @pytest.fixture
 def sample_chat_messages():
-    """Fixture providing sample chat messages."""
-    return [msg.copy() for msg in SAMPLE_CHAT_MESSAGES]
+    """Fixture providing sample chat messages (read-only; use thaw() to modify)."""
+    return SAMPLE_CHAT_MESSAGES
 
 
 @pytest.fixture
 def sample_chat_settings():
-    """Fixture providing sample chat settings."""
-    return SAMPLE_CHAT_SETTINGS.copy()
+    """Fixture providing sample chat settings (read-only; use thaw() to modify)."""
+    return SAMPLE_CHAT_SETTINGS
 
 
 @pytest.fixture
 def sample_user_session():
-    """Fixture providing sample user session data."""
-    return SAMPLE_USER_SESSION.copy()
+    """Fixture providing sample user session data (read-only; use thaw() to modify)."""
+    return SAMPLE_USER_SESSION
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    """Fixture providing the app module, imported once per test session (worker)."""
+    import app
+    return app
+
+
+# Chainlit callbacks exercised by test_app.py (set_starters is disabled in app.py)
+AppSymbols = namedtuple("AppSymbols", ["header_auth_callback", "chat_profile", "on_chat_resume", "start", "main"])
+
+
+@pytest.fixture(scope="session")
+def app_syms(app_module):
+    """Fixture providing the app callbacks, looked up once per test session (worker)."""
+    return AppSymbols(*operator.attrgetter(*AppSymbols._fields)(app_module))
+
+
+@pytest.fixture(scope="session")
+def test_config_file():
+    """Fixture providing utils.test_config.test_config_file, imported once per test session (worker)."""
+    from utils.test_config import test_config_file
+    return test_config_file
+
+
+@pytest.fixture(scope="session")
+def foundry_chat_settings():
+    """Fixture providing chat settings for a Foundry profile (read-only)."""
+    return _freeze({
+        "temperature": 0.7,
+        "instructions": "Test instructions",
+        "model_provider": "foundry"
+    })
+
+
+@pytest.fixture(scope="session")
+def foundry_llm_details():
+    """Fixture providing the model configuration of a Foundry agent (read-only)."""
+    return _freeze({
+        "model_deployment": "foundry/gpt-4.1",
+        "api_endpoint": "https://test.foundry.azure.com",
+        "model_id": "asst_test123"
+    })
+
+
+# Chat settings of a Foundry agent conversation
+AGENT_CHAT_SETTINGS = _freeze({
+    "model_name": "gpt-4.1",
+    "temperature": 0.7
+})
+
+# Default session state of a Foundry agent conversation (no files, thread 'thread123')
+AGENT_SESSION_STATE = _freeze({
+    "chat_settings": AGENT_CHAT_SETTINGS,
+    "chat_profile": "foundry/gpt-4.1",
+    "thread_id": "thread123",
+    "file_uploads": [],
+    "file_contents": [],
+    "uploaded_files": [],
+    "start_time": 1234567880
+})
+
+
+class FakeUserSession:
+    """Dict-backed stand-in for cl.user_session; tests read and seed `data` directly."""
+
+    def __init__(self, data=None):
+        self.data = {} if data is None else data
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+
+@pytest.fixture
+def fake_session(monkeypatch):
+    """Fixture installing an empty FakeUserSession as cl.user_session."""
+    session = FakeUserSession()
+    monkeypatch.setattr(cl, "user_session", session)
+    return session
+
+
+@pytest.fixture
+def make_user_session(monkeypatch):
+    """
+    Fixture providing a factory that installs a mocked cl.user_session for a Foundry agent conversation.
+    
+    Keyword arguments override the values in AGENT_SESSION_STATE; lookups fall
+    through to the shared defaults, so no session dict is rebuilt per call.
+    """
+    def make(**overrides):
+        session = Mock()
+        session.get.side_effect = ChainMap(overrides, AGENT_SESSION_STATE).get
+        monkeypatch.setattr(cl, "user_session", session)
+        return session
+    return make
+
+
+@pytest.fixture
+def make_stream_context():
+    """
+    Fixture providing a factory for `runs.stream()` context managers that yield the given events.
+    
+    chat_agent() consumes the stream with a synchronous `with`/`for`, so the context
+    manager is synchronous and hands out a one-shot iterator like the SDK's event handler.
+    """
+    def make(events):
+        stream_context = MagicMock()
+        stream_context.__enter__.return_value = iter(events)
+        stream_context.__exit__.return_value = None
+        return stream_context
+    return make
+
+
+@pytest.fixture
+def make_agents_client():
+    """
+    Fixture providing a factory for mocked AgentsClient instances.
+    
+    The client has no thread messages, no agent reply and uploads files as
+    'default_file_id'; tests override only the calls they care about.
+    """
+    def make():
+        client = Mock()
+        client.messages.list.return_value = []
+        client.messages.get_last_message_text_by_role.return_value = None
+        client.files.upload_and_poll.return_value = SimpleNamespace(id="default_file_id")
+        return client
+    return make
+
+
+@pytest.fixture
+def message_mock():
+    """Fixture providing an AsyncMock standing in for a cl.Message instance."""
+    message = AsyncMock()
+    message.content = ""
+    message.elements = []
+    return message
+
+
+@pytest.fixture
+def sync_message_mock():
+    """
+    Fixture providing a plain Mock cl.Message instance with awaitable send/update.
+    
+    Use it when the code under test assigns attributes such as `elements` on the
+    message returned by `send()`, which is the message itself here.
+    """
+    message = Mock(send=AsyncMock(), update=AsyncMock(), content="", elements=[])
+    message.send.return_value = message
+    return message
+
+
+@pytest.fixture(scope="session")
+def azure_chat_settings():
+    """Fixture providing chat settings for an Azure OpenAI profile (read-only)."""
+    return _freeze({
+        "model_provider": "azure",
+        "temperature": 0.7
+    })
+
+
+@pytest.fixture(scope="session")
+def user_message():
+    """Fixture providing an incoming user message without attachments (copy before mutating)."""
+    message = Mock(spec=cl.Message)
+    message.content = "Test user message"
+    message.elements = []
+    return message
 
 
 @pytest.fixture
@@ -147,8 +353,8 @@ def sample_file_elements():
 @pytest.fixture
 def temp_config_file():
     """Fixture providing a temporary config file for testing."""
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
-        json.dump(SAMPLE_LLM_MODELS, f)
+    with tempfile.NamedTemporaryFile(mode='wb', suffix='.json', delete=False) as f:
+        f.write(orjson.dumps(thaw(SAMPLE_LLM_MODELS)))
         temp_path = f.name
     
     yield temp_path
@@ -2,577 +2,486 @@
 # Tests LLM parameter building and chat completion with multiple providers
 
 import pytest
-import time
-from unittest.mock import Mock, patch, AsyncMock, MagicMock
-import chainlit as cl
-import sys
-import os
-
-# Add the parent directory to the path to import the chats module
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from unittest.mock import patch, AsyncMock, MagicMock
+from types import SimpleNamespace
+from typing import Optional
+from dataclasses import dataclass, field
 
+from utils import chats as chats_module
+from utils.utils import request_start_ns
 from utils.chats import (
     get_llm_params,
     chat_completion
 )
 
 
-class TestGetLlmParams:
-    """Test cases for get_llm_params function."""
-    
-    def setup_method(self):
-        """Set up test data for each test method."""
-        self.mock_messages = [
-            {"role": "system", "content": "You are a helpful assistant"},
-            {"role": "user", "content": "Hello world"}
-        ]
-        
-        self.mock_azure_model = {
-            "model_deployment": "azure/gpt-4",
+# Messages passed to get_llm_params/chat_completion (never mutated by the callee)
+MESSAGES = (
+    {"role": "system", "content": "You are a helpful assistant"},
+    {"role": "user", "content": "Hello world"}
+)
+
+CHAT_SETTINGS = {"model_name": "gpt-4", "temperature": 0.7}
+
+# Session values read by chat_completion
+SESSION_DATA = {"chat_settings": CHAT_SETTINGS, "start_time": 1234567880}
+
+# Model configurations served by the mocked get_deployment_index
+AZURE_MODEL = {
+    "model_deployment": "azure/gpt-4",
+    "api_key": "test-azure-key",
+    "api_endpoint": "https://test.openai.azure.com",
+    "api_version": "2023-05-15"
+}
+
+PERPLEXITY_MODEL = {
+    "model_deployment": "perplexity/sonar",
+    "api_key": "test-perplexity-key"
+}
+
+AZURE_SETTINGS = {"temperature": 0.7, "model_provider": "azure", "model_name": "gpt-4"}
+
+# get_llm_params scenarios: session/config inputs and the expected parameters
+GET_LLM_PARAMS_CASES = [
+    {
+        "id": "azure_basic",
+        "model": AZURE_MODEL,
+        "chat_settings": AZURE_SETTINGS,
+        "chat_profile": "azure/gpt-4",
+        "use_tools": False,
+        "expected": {
             "api_key": "test-azure-key",
-            "api_endpoint": "https://test.openai.azure.com",
-            "api_version": "2023-05-15"
-        }
-        
-        self.mock_foundry_model = {
-            "model_deployment": "foundry/gpt-4.1",
-            "api_key": "test-foundry-key",
-            "api_endpoint": "https://test.foundry.azure.com"
-        }
-        
-        self.mock_perplexity_model = {
-            "model_deployment": "perplexity/sonar",
-            "api_key": "test-perplexity-key"
-        }
+            "api_version": "2023-05-15",
+            "api_base": "https://test.openai.azure.com",
+            "temperature": 0.7
+        },
+        "absent": [],
+        "tool_names": []
+    },
+    {
+        "id": "azure_o3_mini_no_temperature",
+        "model": {**AZURE_MODEL, "model_deployment": "azure/o3-mini"},
+        "chat_settings": {**AZURE_SETTINGS, "model_name": "o3-mini"},
+        "chat_profile": "azure/o3-mini",
+        "use_tools": False,
+        "expected": {},
+        "absent": ["temperature"],
+        "tool_names": []
+    },
+    {
+        "id": "non_azure_provider",
+        "model": PERPLEXITY_MODEL,
+        "chat_settings": {"temperature": 0.8, "model_provider": "perplexity", "model_name": "sonar"},
+        "chat_profile": "perplexity/sonar",
+        "use_tools": False,
+        "expected": {"temperature": 0.8, "api_key": "test-perplexity-key"},
+        "absent": ["api_version", "api_base"],
+        "tool_names": []
+    },
+    {
+        "id": "with_tools",
+        "model": AZURE_MODEL,
+        "chat_settings": AZURE_SETTINGS,
+        "chat_profile": "azure/gpt-4",
+        "use_tools": True,
+        "expected": {},
+        "absent": [],
+        "tool_names": ["search_web"]
+    },
+    {
+        "id": "without_tools",
+        "model": AZURE_MODEL,
+        "chat_settings": AZURE_SETTINGS,
+        "chat_profile": "azure/gpt-4",
+        "use_tools": False,
+        "expected": {},
+        "absent": ["tools"],
+        "tool_names": []
+    },
+    {
+        "id": "azure_no_api_version",
+        "model": {**AZURE_MODEL, "api_version": None},
+        "chat_settings": AZURE_SETTINGS,
+        "chat_profile": "azure/gpt-4",
+        "use_tools": False,
+        "expected": {},
+        "absent": ["api_version"],
+        "tool_names": []
+    },
+    {
+        "id": "azure_no_api_endpoint",
+        "model": {**AZURE_MODEL, "api_endpoint": None},
+        "chat_settings": AZURE_SETTINGS,
+        "chat_profile": "azure/gpt-4",
+        "use_tools": False,
+        "expected": {},
+        "absent": ["api_base"],
+        "tool_names": []
+    },
+    {
+        "id": "model_not_found",
+        "model": AZURE_MODEL,
+        "chat_settings": {**AZURE_SETTINGS, "model_name": "gpt-3.5"},
+        "chat_profile": "azure/gpt-3.5",  # This model doesn't exist in the config
+        "use_tools": False,
+        "expected": {},
+        "absent": ["api_key"],
+        "tool_names": []
+    },
+]
 
-    @patch('utils.chats.cl.user_session')
-    @patch('utils.chats.get_llm_models')
-    def test_get_llm_params_azure_basic(self, mock_get_llm_models, mock_user_session):
-        """Test get_llm_params for Azure model with basic parameters."""
-        mock_get_llm_models.return_value = [self.mock_azure_model]
-        
-        mock_chat_settings = {
-            "temperature": 0.7,
-            "model_provider": "azure",
-            "model_name": "gpt-4"
-        }
-        
-        mock_user_session.get.side_effect = lambda key: {
-            "chat_settings": mock_chat_settings,
-            "chat_profile": "azure/gpt-4"
-        }.get(key)
-        
-        result = get_llm_params(self.mock_messages)
-        
-        assert result["model"] == "azure/gpt-4"
-        assert result["messages"] == self.mock_messages
-        assert result["stream"] is True
-        assert result["api_key"] == "test-azure-key"
-        assert result["api_version"] == "2023-05-15"
-        assert result["api_base"] == "https://test.openai.azure.com"
-        assert result["temperature"] == 0.7
-
-    @patch('utils.chats.cl.user_session')
-    @patch('utils.chats.get_llm_models')
-    def test_get_llm_params_azure_o3_mini_no_temperature(self, mock_get_llm_models, mock_user_session):
-        """Test get_llm_params for Azure o3-mini model (should not include temperature)."""
-        o3_model = self.mock_azure_model.copy()
-        o3_model["model_deployment"] = "azure/o3-mini"
-        mock_get_llm_models.return_value = [o3_model]
-        
-        mock_chat_settings = {
-            "temperature": 0.7,
-            "model_provider": "azure",
-            "model_name": "o3-mini"
-        }
-        
-        mock_user_session.get.side_effect = lambda key: {
-            "chat_settings": mock_chat_settings,
-            "chat_profile": "azure/o3-mini"
-        }.get(key)
-        
-        result = get_llm_params(self.mock_messages)
-        
-        assert "temperature" not in result
-        assert result["model"] == "azure/o3-mini"
 
-    @patch('utils.chats.cl.user_session')
-    @patch('utils.chats.get_llm_models')
-    def test_get_llm_params_non_azure_provider(self, mock_get_llm_models, mock_user_session):
-        """Test get_llm_params for non-Azure provider."""
-        mock_get_llm_models.return_value = [self.mock_perplexity_model]
-        
-        mock_chat_settings = {
-            "temperature": 0.8,
-            "model_provider": "perplexity",
-            "model_name": "sonar"
-        }
-        
-        mock_user_session.get.side_effect = lambda key: {
-            "chat_settings": mock_chat_settings,
-            "chat_profile": "perplexity/sonar"
-        }.get(key)
-        
-        result = get_llm_params(self.mock_messages)
-        
-        assert result["model"] == "perplexity/sonar"
-        assert result["temperature"] == 0.8  # Should be float for non-Azure
-        assert result["api_key"] == "test-perplexity-key"
-        assert "api_version" not in result
-        assert "api_base" not in result
-
-    @patch('utils.chats.cl.user_session')
-    @patch('utils.chats.get_llm_models')
-    def test_get_llm_params_with_tools(self, mock_get_llm_models, mock_user_session):
-        """Test get_llm_params with tools enabled."""
-        mock_get_llm_models.return_value = [self.mock_azure_model]
-        
-        mock_chat_settings = {
-            "temperature": 0.7,
-            "model_provider": "azure",
-            "model_name": "gpt-4"
-        }
-        
-        mock_user_session.get.side_effect = lambda key: {
-            "chat_settings": mock_chat_settings,
-            "chat_profile": "azure/gpt-4"
-        }.get(key)
-        
-        result = get_llm_params(self.mock_messages, use_tools=True)
-        
-        assert "tools" in result
-        assert len(result["tools"]) == 1
-        assert result["tools"][0]["type"] == "function"
-        assert result["tools"][0]["function"]["name"] == "search_web"
+@dataclass(slots=True)
+class Delta:
+    """Content delta of a streamed choice."""
+    content: Optional[str] = None
 
-    @patch('utils.chats.cl.user_session')
-    @patch('utils.chats.get_llm_models')
-    def test_get_llm_params_without_tools(self, mock_get_llm_models, mock_user_session):
-        """Test get_llm_params without tools."""
-        mock_get_llm_models.return_value = [self.mock_azure_model]
-        
-        mock_chat_settings = {
-            "temperature": 0.7,
-            "model_provider": "azure",
-            "model_name": "gpt-4"
-        }
-        
-        mock_user_session.get.side_effect = lambda key: {
-            "chat_settings": mock_chat_settings,
-            "chat_profile": "azure/gpt-4"
-        }.get(key)
-        
-        result = get_llm_params(self.mock_messages, use_tools=False)
-        
-        assert "tools" not in result
 
-    @patch('utils.chats.cl.user_session')
-    @patch('utils.chats.get_llm_models')
-    def test_get_llm_params_azure_no_api_version(self, mock_get_llm_models, mock_user_session):
-        """Test get_llm_params for Azure model without API version."""
-        azure_model_no_version = self.mock_azure_model.copy()
-        azure_model_no_version["api_version"] = None
-        mock_get_llm_models.return_value = [azure_model_no_version]
-        
-        mock_chat_settings = {
-            "temperature": 0.7,
-            "model_provider": "azure",
-            "model_name": "gpt-4"
-        }
-        
-        mock_user_session.get.side_effect = lambda key: {
-            "chat_settings": mock_chat_settings,
-            "chat_profile": "azure/gpt-4"
-        }.get(key)
-        
-        result = get_llm_params(self.mock_messages)
-        
-        assert "api_version" not in result
+@dataclass(slots=True)
+class Choice:
+    """Single choice of a streamed chunk."""
+    delta: Delta = field(default_factory=Delta)
 
-    @patch('utils.chats.cl.user_session')
-    @patch('utils.chats.get_llm_models')
-    def test_get_llm_params_azure_no_api_endpoint(self, mock_get_llm_models, mock_user_session):
-        """Test get_llm_params for Azure model without API endpoint."""
-        azure_model_no_endpoint = self.mock_azure_model.copy()
-        azure_model_no_endpoint["api_endpoint"] = None
-        mock_get_llm_models.return_value = [azure_model_no_endpoint]
-        
-        mock_chat_settings = {
-            "temperature": 0.7,
-            "model_provider": "azure",
-            "model_name": "gpt-4"
-        }
-        
-        mock_user_session.get.side_effect = lambda key: {
-            "chat_settings": mock_chat_settings,
-            "chat_profile": "azure/gpt-4"
-        }.get(key)
-        
-        result = get_llm_params(self.mock_messages)
-        
-        assert "api_base" not in result
 
-    @patch('utils.chats.cl.user_session')
-    @patch('utils.chats.get_llm_models')
-    def test_get_llm_params_model_not_found(self, mock_get_llm_models, mock_user_session):
-        """Test get_llm_params when model is not found in config."""
-        mock_get_llm_models.return_value = [self.mock_azure_model]
-        
-        mock_chat_settings = {
-            "temperature": 0.7,
-            "model_provider": "azure",
-            "model_name": "gpt-3.5"
-        }
-        
-        mock_user_session.get.side_effect = lambda key: {
-            "chat_settings": mock_chat_settings,
-            "chat_profile": "azure/gpt-3.5"  # This model doesn't exist in mock_models
-        }.get(key)
-        
-        result = get_llm_params(self.mock_messages)
-        
-        # Should still return basic parameters even if model not found
-        assert result["model"] == "azure/gpt-3.5"
-        assert result["messages"] == self.mock_messages
+@dataclass(slots=True)
+class StreamChunk:
+    """Stand-in for a LiteLLM streaming chunk; `citations` is empty when the chunk carries none."""
+    choices: list = field(default_factory=list)
+    citations: list = field(default_factory=list)
+
+
+def make_chunk(content=None, citations=None):
+    """
+    Build a streaming chunk carrying a content delta and/or citations.
+    
+    A chunk with neither content nor citations has no choices, like the final chunk of a stream.
+    """
+    choices = [] if content is None and citations is None else [Choice(Delta(content))]
+    return StreamChunk(choices=choices, citations=citations or [])
+
+
+def stream(*chunks):
+    """Build an acompletion() side effect returning an async stream of the given chunks, like LiteLLM."""
+    async def chunk_stream():
+        for chunk in chunks:
+            yield chunk
+
+    async def acompletion(**kwargs):
+        return chunk_stream()
+    return acompletion
+
+
+# Final (empty) chunk of a stream, shared since chunks are never mutated
+END_CHUNK = make_chunk()
+
+
+def append_token(message):
+    """Build a stream_token side effect that appends to the mocked message content."""
+    async def stream_token(token):
+        message.content += token
+    return stream_token
+
+
+class TestGetLlmParams:
+    """Test cases for get_llm_params function."""
+    
+    @pytest.fixture(autouse=True)
+    def patched(self, monkeypatch):
+        """Install the session and model config mocks once per test."""
+        self.mock_us = MagicMock()
+        self.mock_index = MagicMock()
+        monkeypatch.setattr(chats_module.cl, "user_session", self.mock_us)
+        monkeypatch.setattr(chats_module, "get_deployment_index", self.mock_index)
+
+    @pytest.mark.parametrize("case", GET_LLM_PARAMS_CASES, ids=[case["id"] for case in GET_LLM_PARAMS_CASES])
+    def test_get_llm_params(self, case):
+        """Test get_llm_params across providers, model config gaps and tool settings."""
+        self.mock_index.return_value = {case["model"]["model_deployment"]: case["model"]}
+        self.mock_us.get.side_effect = {
+            "chat_settings": case["chat_settings"],
+            "chat_profile": case["chat_profile"]
+        }.get
+        
+        result = get_llm_params(MESSAGES, use_tools=case["use_tools"])
+        
+        # Basic parameters are always present, even if the model is not found
+        assert result["model"] == case["chat_profile"]
+        assert result["messages"] == MESSAGES
         assert result["stream"] is True
+        for key, value in case["expected"].items():
+            assert result[key] == value
+        for key in case["absent"]:
+            assert key not in result
+        assert [tool["function"]["name"] for tool in result.get("tools", [])] == case["tool_names"]
 
 
 class TestChatCompletion:
     """Test cases for chat_completion function."""
-    
-    def setup_method(self):
-        """Set up test data for each test method."""
-        self.mock_messages = [
-            {"role": "system", "content": "You are a helpful assistant"},
-            {"role": "user", "content": "Hello world"}
-        ]
-        
-        self.mock_settings = {
-            "model_name": "gpt-4",
-            "temperature": 0.7
-        }
 
-    @patch('utils.chats.cl.user_session')
-    @patch('utils.chats.cl.Message')
-    @patch('utils.chats.get_llm_params')
-    @patch('utils.chats.completion')
-    @patch('utils.chats.time.time')
-    async def test_chat_completion_successful_response(self, mock_time, mock_completion, 
+    @pytest.fixture
+    def make_cl_message(self):
+        """Provide a factory for cl.Message instances with no-op send/update."""
+        def make(content=""):
+            message = SimpleNamespace(content=content)
+            
+            async def send(*args, **kwargs):
+                return message
+            
+            async def update(*args, **kwargs):
+                return None
+            
+            message.send = send
+            message.update = update
+            message.stream_token = AsyncMock(side_effect=append_token(message))
+            return message
+        return make
+    
+    @patch.object(chats_module.cl, 'user_session')
+    @patch.object(chats_module.cl, 'Message')
+    @patch.object(chats_module, 'get_llm_params')
+    @patch.object(chats_module, 'acompletion')
+    @patch('utils.utils.time.monotonic_ns')
+    async def test_chat_completion_successful_response(self, mock_monotonic_ns, mock_acompletion, 
                                                       mock_get_llm_params, mock_message_class, 
-                                                      mock_user_session):
+                                                      mock_user_session, make_cl_message):
         """Test successful chat completion response."""
-        # Mock setup
-        mock_time.return_value = 1234567890
-        mock_user_session.get.side_effect = lambda key: {
-            "chat_settings": self.mock_settings,
-            "start_time": 1234567880
-        }.get(key)
-        
-        mock_message_instance = Mock()  # Use regular Mock instead of AsyncMock
-        mock_message_instance.content = ""
-        mock_message_instance.update = AsyncMock()
-        
-        # The send() method should return the message instance itself when awaited
-        mock_send = AsyncMock(return_value=mock_message_instance)
-        mock_message_instance.send = mock_send
+        # Mock setup: the request started 2.5 seconds before the first chunk arrives
+        mock_monotonic_ns.return_value = 3_500_000_000
+        start_token = request_start_ns.set(1_000_000_000)
+        mock_user_session.get.side_effect = SESSION_DATA.get
+        
+        mock_message_instance = make_cl_message()
         mock_message_class.return_value = mock_message_instance
         
         mock_get_llm_params.return_value = {
             "model": "azure/gpt-4",
-            "messages": self.mock_messages
+            "messages": MESSAGES
         }
         
         # Mock completion response
-        mock_chunk1 = Mock()
-        mock_chunk1.choices = [Mock()]
-        mock_chunk1.choices[0].delta = Mock()
-        mock_chunk1.choices[0].delta.content = "Hello"
-        mock_chunk1.__contains__ = Mock(return_value=False)  # For "citations" in chunk
-        
-        mock_chunk2 = Mock()
-        mock_chunk2.choices = [Mock()]
-        mock_chunk2.choices[0].delta = Mock()
-        mock_chunk2.choices[0].delta.content = " world!"
-        mock_chunk2.__contains__ = Mock(return_value=False)
-        
-        mock_chunk3 = Mock()
-        mock_chunk3.choices = []  # Empty list for last chunk
-        mock_chunk3.__contains__ = Mock(return_value=False)
-        
-        mock_completion.return_value = [mock_chunk1, mock_chunk2, mock_chunk3]
+        mock_acompletion.side_effect = stream(make_chunk("Hello"), make_chunk(" world!"), END_CHUNK)
         
         # Execute function
-        result = await chat_completion(self.mock_messages)
+        try:
+            with patch.object(chats_module, 'logger') as mock_logger:
+                result = await chat_completion(MESSAGES)
+        finally:
+            request_start_ns.reset(start_token)
         
         # Verify result
         assert result == "Hello world!"
+        # Elapsed time is measured from request_start_ns to the first chunk
+        mock_logger.info.assert_any_call("Elapsed time: 2.50 seconds")
+        # Both deltas arrive within one flush interval, so they are sent as a single batch
+        mock_message_instance.stream_token.assert_awaited_once_with("Hello world!")
         # send() method was called (it's a function, not a mock)
         # Note: update() may not be called if mocking prevents the condition check
         # The important thing is that we get the expected result
 
-    @patch('utils.chats.cl.user_session')
-    @patch('utils.chats.cl.Message')
-    @patch('utils.chats.get_llm_params')
-    @patch('utils.chats.completion')
-    async def test_chat_completion_with_citations(self, mock_completion, mock_get_llm_params, 
-                                                 mock_message_class, mock_user_session):
-        """Test chat completion with citations in response."""
+    @patch.object(chats_module, 'STREAM_FLUSH_TOKENS', 2)
+    @patch.object(chats_module.cl, 'user_session')
+    @patch.object(chats_module.cl, 'Message')
+    @patch.object(chats_module, 'get_llm_params')
+    @patch.object(chats_module, 'acompletion')
+    async def test_chat_completion_flushes_batches(self, mock_acompletion, mock_get_llm_params,
+                                                  mock_message_class, mock_user_session, make_cl_message):
+        """Test that buffered deltas are flushed every STREAM_FLUSH_TOKENS tokens."""
+        mock_user_session.get.side_effect = SESSION_DATA.get
+        
+        mock_message_instance = make_cl_message()
+        mock_message_class.return_value = mock_message_instance
+        
+        mock_get_llm_params.return_value = {
+            "model": "azure/gpt-4",
+            "messages": MESSAGES
+        }
+        
+        mock_acompletion.side_effect = stream(*(make_chunk(token) for token in "abcde"))
+        
+        result = await chat_completion(MESSAGES)
+        
+        assert result == "abcde"
+        assert [c.args[0] for c in mock_message_instance.stream_token.await_args_list] == ["ab", "cd", "e"]
+
+    @patch.object(chats_module.cl, 'user_session')
+    @patch.object(chats_module.cl, 'Message')
+    @patch.object(chats_module, 'get_llm_params')
+    @patch.object(chats_module, 'acompletion')
+    @pytest.mark.parametrize("trailing", [(), (END_CHUNK,)], ids=["citations_last", "finish_chunk_last"])
+    async def test_chat_completion_with_citations(self, mock_acompletion, mock_get_llm_params, 
+                                                 mock_message_class, mock_user_session, make_cl_message, trailing):
+        """Test chat completion with citations in response, even when a later chunk carries none."""
         # Mock setup
-        mock_user_session.get.side_effect = lambda key: {
-            "chat_settings": self.mock_settings,
-            "start_time": 1234567880
-        }.get(key)
-        
-        mock_message_instance = Mock()  # Use regular Mock instead of AsyncMock
-        mock_message_instance.content = ""
-        mock_message_instance.update = AsyncMock()
-        
-        # The send() method should return the message instance itself when awaited
-        mock_send = AsyncMock(return_value=mock_message_instance)
-        mock_message_instance.send = mock_send
+        mock_user_session.get.side_effect = SESSION_DATA.get
+        
+        mock_message_instance = make_cl_message()
         mock_message_class.return_value = mock_message_instance
         
         mock_get_llm_params.return_value = {
             "model": "azure/gpt-4",
-            "messages": self.mock_messages
+            "messages": MESSAGES
         }
         
         # Mock completion response with citations
-        mock_chunk1 = Mock()
-        mock_chunk1.choices = [Mock()]
-        mock_chunk1.choices[0].delta = Mock()
-        mock_chunk1.choices[0].delta.content = "Response text"
-        mock_chunk1.__contains__ = Mock(return_value=False)
-        
-        mock_chunk_with_citations = Mock()
-        mock_chunk_with_citations.choices = [Mock()]
-        mock_chunk_with_citations.choices[0].delta = Mock()
-        mock_chunk_with_citations.choices[0].delta.content = None
-        mock_chunk_with_citations.__contains__ = Mock(side_effect=lambda x: x == "citations")
-        mock_chunk_with_citations.citations = [
+        mock_chunk_with_citations = make_chunk(citations=[
             "https://example.com/source1",
             "https://example.com/source2"
-        ]
+        ])
         
-        mock_completion.return_value = [mock_chunk1, mock_chunk_with_citations]
+        mock_acompletion.side_effect = stream(make_chunk("Response text"), mock_chunk_with_citations, *trailing)
         
         # Execute function
-        result = await chat_completion(self.mock_messages)
+        result = await chat_completion(MESSAGES)
         
         # Verify citations were added
         assert "**Sources:**" in result
         assert "[https://example.com/source1](https://example.com/source1)" in result
         assert "[https://example.com/source2](https://example.com/source2)" in result
 
-    @patch('utils.chats.cl.user_session')
-    @patch('utils.chats.cl.Message')
-    @patch('utils.chats.get_llm_params')
-    @patch('utils.chats.completion')
-    async def test_chat_completion_with_thinking_removal(self, mock_completion, mock_get_llm_params, 
-                                                        mock_message_class, mock_user_session):
+    @patch.object(chats_module.cl, 'user_session')
+    @patch.object(chats_module.cl, 'Message')
+    @patch.object(chats_module, 'get_llm_params')
+    @patch.object(chats_module, 'acompletion')
+    async def test_chat_completion_with_thinking_removal(self, mock_acompletion, mock_get_llm_params, 
+                                                        mock_message_class, mock_user_session, make_cl_message):
         """Test chat completion with thinking tags removal."""
         # Mock setup
-        mock_user_session.get.side_effect = lambda key: {
-            "chat_settings": self.mock_settings,
-            "start_time": 1234567880
-        }.get(key)
-        
-        mock_message_instance = Mock()  # Use regular Mock instead of AsyncMock
-        mock_message_instance.content = "<think>Let me think about this...</think>Here's my response"
-        mock_message_instance.update = AsyncMock()
-        
-        # The send() method should return the message instance itself when awaited
-        mock_send = AsyncMock(return_value=mock_message_instance)
-        mock_message_instance.send = mock_send
+        mock_user_session.get.side_effect = SESSION_DATA.get
+        
+        mock_message_instance = make_cl_message("<think>Let me think about this...</think>Here's my response")
         mock_message_class.return_value = mock_message_instance
         
         mock_get_llm_params.return_value = {
             "model": "azure/gpt-4",
-            "messages": self.mock_messages
+            "messages": MESSAGES
         }
         
         # Mock completion response
-        mock_chunk = Mock()
-        mock_chunk.choices = [Mock()]
-        mock_chunk.choices[0].delta = Mock()
-        mock_chunk.choices[0].delta.content = "<think>Let me think about this...</think>Here's my response"
-        mock_chunk.__contains__ = Mock(return_value=False)  # For "citations" in chunk
-        
-        mock_completion.return_value = [mock_chunk]
+        mock_acompletion.side_effect = stream(make_chunk("<think>Let me think about this...</think>Here's my response"))
         
         # Execute function
-        result = await chat_completion(self.mock_messages)
+        result = await chat_completion(MESSAGES)
         
         # Verify thinking tags were removed
         assert result == "Here's my response"
         assert "<think>" not in result
         assert "</think>" not in result
 
-    @patch('utils.chats.cl.user_session')
-    @patch('utils.chats.cl.Message')
-    @patch('utils.chats.get_llm_params')
-    @patch('utils.chats.completion')
-    async def test_chat_completion_with_exception(self, mock_completion, mock_get_llm_params, 
-                                                 mock_message_class, mock_user_session):
+    @patch.object(chats_module.cl, 'user_session')
+    @patch.object(chats_module.cl, 'Message')
+    @patch.object(chats_module, 'get_llm_params')
+    @patch.object(chats_module, 'acompletion')
+    async def test_chat_completion_with_exception(self, mock_acompletion, mock_get_llm_params, 
+                                                 mock_message_class, mock_user_session, make_cl_message):
         """Test chat completion when an exception occurs."""
         # Mock setup
-        mock_user_session.get.side_effect = lambda key: {
-            "chat_settings": self.mock_settings,
-            "start_time": 1234567880
-        }.get(key)
-        
-        mock_message_instance = Mock()  # Use regular Mock instead of AsyncMock
-        mock_message_instance.content = ""  # Initialize content
-        mock_message_instance.update = AsyncMock()
-        
-        # The send() method should return the message instance itself when awaited
-        mock_send = AsyncMock(return_value=mock_message_instance)
-        mock_message_instance.send = mock_send
+        mock_user_session.get.side_effect = SESSION_DATA.get
+        
+        mock_message_instance = make_cl_message()
         mock_message_class.return_value = mock_message_instance
         
         mock_get_llm_params.return_value = {
             "model": "azure/gpt-4",
-            "messages": self.mock_messages
+            "messages": MESSAGES
         }
         
         # Mock completion to raise exception
-        mock_completion.side_effect = Exception("API Error")
+        mock_acompletion.side_effect = Exception("API Error")
         
         # Execute function and expect RuntimeError
         with pytest.raises(RuntimeError) as exc_info:
-            await chat_completion(self.mock_messages)
+            await chat_completion(MESSAGES)
         
         assert "Error generating response in chat_completion" in str(exc_info.value)
         assert "API Error" in str(exc_info.value)
 
-    @patch('utils.chats.cl.user_session')
-    @patch('utils.chats.cl.Message')
-    @patch('utils.chats.get_llm_params')
-    @patch('utils.chats.completion')
-    async def test_chat_completion_empty_response(self, mock_completion, mock_get_llm_params, 
-                                                 mock_message_class, mock_user_session):
+    @patch.object(chats_module.cl, 'user_session')
+    @patch.object(chats_module.cl, 'Message')
+    @patch.object(chats_module, 'get_llm_params')
+    @patch.object(chats_module, 'acompletion')
+    async def test_chat_completion_empty_response(self, mock_acompletion, mock_get_llm_params, 
+                                                 mock_message_class, mock_user_session, make_cl_message):
         """Test chat completion with empty response."""
         # Mock setup
-        mock_user_session.get.side_effect = lambda key: {
-            "chat_settings": self.mock_settings,
-            "start_time": 1234567880
-        }.get(key)
-        
-        mock_message_instance = Mock()  # Use regular Mock instead of AsyncMock
-        mock_message_instance.content = ""
-        mock_message_instance.update = AsyncMock()
-        
-        # The send() method should return the message instance itself when awaited
-        mock_send = AsyncMock(return_value=mock_message_instance)
-        mock_message_instance.send = mock_send
+        mock_user_session.get.side_effect = SESSION_DATA.get
+        
+        mock_message_instance = make_cl_message()
         mock_message_class.return_value = mock_message_instance
         
         mock_get_llm_params.return_value = {
             "model": "azure/gpt-4",
-            "messages": self.mock_messages
+            "messages": MESSAGES
         }
         
         # Mock completion response with no content
-        mock_completion.return_value = []
+        mock_acompletion.side_effect = stream()
         
         # Execute function
-        result = await chat_completion(self.mock_messages)
+        result = await chat_completion(MESSAGES)
         
         # Should return empty string
         assert result == ""
 
-    @patch('utils.chats.cl.user_session')
-    @patch('utils.chats.cl.Message')
-    @patch('utils.chats.get_llm_params')
-    @patch('utils.chats.completion')
-    @patch('utils.chats.time.time')
-    async def test_chat_completion_timing_log(self, mock_time, mock_completion, mock_get_llm_params, 
-                                             mock_message_class, mock_user_session):
+    @patch.object(chats_module.cl, 'user_session')
+    @patch.object(chats_module.cl, 'Message')
+    @patch.object(chats_module, 'get_llm_params')
+    @patch.object(chats_module, 'acompletion')
+    @patch.object(chats_module, 'get_elapsed_time')
+    async def test_chat_completion_timing_log(self, mock_elapsed_time, mock_acompletion, mock_get_llm_params, 
+                                             mock_message_class, mock_user_session, make_cl_message):
         """Test that elapsed time is logged correctly."""
         # Mock setup
-        start_time = 1234567880
-        current_time = 1234567890
-        mock_time.return_value = current_time
-        
-        mock_user_session.get.side_effect = lambda key: {
-            "chat_settings": self.mock_settings,
-            "start_time": start_time
-        }.get(key)
-        
-        mock_message_instance = Mock()  # Use regular Mock instead of AsyncMock
-        mock_message_instance.content = ""
-        mock_message_instance.update = AsyncMock()
-        
-        # The send() method should return the message instance itself when awaited
-        mock_send = AsyncMock(return_value=mock_message_instance)
-        mock_message_instance.send = mock_send
+        mock_elapsed_time.return_value = 10.0
+        
+        mock_user_session.get.side_effect = SESSION_DATA.get
+        
+        mock_message_instance = make_cl_message()
         mock_message_class.return_value = mock_message_instance
         
         mock_get_llm_params.return_value = {
             "model": "azure/gpt-4",
-            "messages": self.mock_messages
+            "messages": MESSAGES
         }
         
         # Mock completion response
-        mock_chunk = Mock()
-        mock_chunk.choices = [Mock()]
-        mock_chunk.choices[0].delta = Mock()
-        mock_chunk.choices[0].delta.content = "Response"
-        mock_chunk.__contains__ = Mock(return_value=False)  # For "citations" in chunk
-        
-        mock_completion.return_value = [mock_chunk]
+        mock_acompletion.side_effect = stream(make_chunk("Response"))
         
         # Execute function
-        with patch('utils.chats.logger') as mock_logger:
-            await chat_completion(self.mock_messages)
+        with patch.object(chats_module, 'logger') as mock_logger:
+            await chat_completion(MESSAGES)
             
             # Verify timing was logged
             timing_calls = [call for call in mock_logger.info.call_args_list 
-                          if "Elapsed time" in str(call)]
+                          if "Elapsed time: 10.00 seconds" in str(call)]
             assert len(timing_calls) > 0
 
-    @patch('utils.chats.cl.user_session')
-    @patch('utils.chats.cl.Message')
-    @patch('utils.chats.get_llm_params')
-    @patch('utils.chats.completion')
-    async def test_chat_completion_with_tools_enabled(self, mock_completion, mock_get_llm_params, 
-                                                     mock_message_class, mock_user_session):
+    @patch.object(chats_module.cl, 'user_session')
+    @patch.object(chats_module.cl, 'Message')
+    @patch.object(chats_module, 'get_llm_params')
+    @patch.object(chats_module, 'acompletion')
+    async def test_chat_completion_with_tools_enabled(self, mock_acompletion, mock_get_llm_params, 
+                                                     mock_message_class, mock_user_session, make_cl_message):
         """Test chat completion with tools enabled."""
         # Mock setup
-        mock_user_session.get.side_effect = lambda key: {
-            "chat_settings": self.mock_settings,
-            "start_time": 1234567880
-        }.get(key)
-        
-        mock_message_instance = Mock()  # Use regular Mock instead of AsyncMock
-        mock_message_instance.content = ""
-        mock_message_instance.update = AsyncMock()
-        
-        # The send() method should return the message instance itself when awaited
-        mock_send = AsyncMock(return_value=mock_message_instance)
-        mock_message_instance.send = mock_send
+        mock_user_session.get.side_effect = SESSION_DATA.get
+        
+        mock_message_instance = make_cl_message()
         mock_message_class.return_value = mock_message_instance
         
         mock_get_llm_params.return_value = {
             "model": "azure/gpt-4",
-            "messages": self.mock_messages,
+            "messages": MESSAGES,
             "tools": [{"type": "function", "function": {"name": "search_web"}}]
         }
         
         # Mock completion response
-        mock_chunk = Mock()
-        mock_chunk.choices = [Mock()]
-        mock_chunk.choices[0].delta = Mock()
-        mock_chunk.choices[0].delta.content = "Response with tools"
-        mock_chunk.__contains__ = Mock(return_value=False)  # For "citations" in chunk
-        
-        mock_completion.return_value = [mock_chunk]
+        mock_acompletion.side_effect = stream(make_chunk("Response with tools"))
         
         # Execute function with tools enabled
-        result = await chat_completion(self.mock_messages, use_tools=True)
+        result = await chat_completion(MESSAGES, use_tools=True)
         
         # Verify tools were passed to get_llm_params
-        mock_get_llm_params.assert_called_once_with(self.mock_messages)
+        mock_get_llm_params.assert_called_once_with(MESSAGES)
 
 
 if __name__ == "__main__":
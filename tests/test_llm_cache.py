@@ -0,0 +1,404 @@
+# Unit tests for utils/llm_cache.py - LLM response cache
+# Tests cache key construction and response storage/eviction
+
+import pytest
+import asyncio
+import orjson
+from types import ModuleType
+from unittest.mock import AsyncMock, Mock, patch
+
+from utils.llm_cache import (
+    LLMCache, MemoryBackend, RedisBackend, SemanticIndex, cache_key, create_llm_cache, semantic_namespace,
+)
+
+
+class TestCacheKey:
+    """Test cases for cache_key function."""
+
+    def setup_method(self):
+        """Set up test data for each test method."""
+        self.mock_messages = [
+            {"role": "system", "content": [{"type": "text", "text": "You are a helpful assistant"}]},
+            {"role": "user", "content": [{"type": "text", "text": "Hello world"}]}
+        ]
+
+    def test_cache_key_is_deterministic(self):
+        """Test that identical requests produce the same key."""
+        assert cache_key("azure/gpt-4", self.mock_messages) == cache_key("azure/gpt-4", list(self.mock_messages))
+
+    def test_cache_key_differs_by_model(self):
+        """Test that the model deployment is part of the key."""
+        assert cache_key("azure/gpt-4", self.mock_messages) != cache_key("azure/o3-mini", self.mock_messages)
+
+    def test_cache_key_differs_by_messages(self):
+        """Test that the messages are part of the key."""
+        other_messages = self.mock_messages[:1]
+        assert cache_key("azure/gpt-4", self.mock_messages) != cache_key("azure/gpt-4", other_messages)
+
+
+class TestSemanticNamespace:
+    """Test cases for semantic_namespace function."""
+
+    def setup_method(self):
+        """Set up test data for each test method."""
+        self.system = {"role": "system", "content": [{"type": "text", "text": "You are a helpful assistant"}]}
+        self.history = [
+            {"role": "user", "content": [{"type": "text", "text": "<file_name:policy.pdf>Leave rules"}]},
+            {"role": "assistant", "content": [{"type": "text", "text": "I have read the document."}]},
+        ]
+
+    def user(self, text: str) -> dict:
+        """Build a user message."""
+        return {"role": "user", "content": [{"type": "text", "text": text}]}
+
+    def test_same_context_shares_namespace(self):
+        """Test that different prompts with the same preceding context share a namespace."""
+        first = semantic_namespace("azure/gpt-4", [self.system, self.user("What is the leave policy?")])
+        second = semantic_namespace("azure/gpt-4", [self.system, self.user("Tell me the leave policy")])
+
+        assert first == second
+        assert first.startswith("azure/gpt-4:")
+
+    def test_history_changes_namespace(self):
+        """Test that earlier turns (e.g. file uploads) partition the namespace."""
+        prompt = self.user("Summarize the above")
+
+        assert semantic_namespace("azure/gpt-4", [self.system, prompt]) != \
+            semantic_namespace("azure/gpt-4", [self.system, *self.history, prompt])
+
+    def test_system_prompt_changes_namespace(self):
+        """Test that session instructions partition the namespace."""
+        other_system = {"role": "system", "content": [{"type": "text", "text": "Answer in French"}]}
+        prompt = self.user("What is the leave policy?")
+
+        assert semantic_namespace("azure/gpt-4", [self.system, prompt]) != \
+            semantic_namespace("azure/gpt-4", [other_system, prompt])
+
+
+class TestLLMCache:
+    """Test cases for LLMCache class."""
+
+    async def test_get_miss_returns_none(self):
+        """Test that an unknown key returns None."""
+        cache = LLMCache()
+
+        assert await cache.get("missing") is None
+
+    async def test_set_then_get(self):
+        """Test that a stored response is returned on the next lookup."""
+        cache = LLMCache()
+        await cache.set("key", "Cached response")
+
+        assert await cache.get("key") == "Cached response"
+
+    async def test_evicts_least_recently_used(self):
+        """Test that the least recently used entry is evicted when full."""
+        cache = LLMCache(l1=MemoryBackend(maxsize=2))
+        await cache.set("a", "A")
+        await cache.set("b", "B")
+        await cache.get("a")  # Touch "a" so "b" becomes the oldest
+        await cache.set("c", "C")
+
+        assert await cache.get("a") == "A"
+        assert await cache.get("b") is None
+        assert await cache.get("c") == "C"
+
+    async def test_l2_hit_populates_l1(self):
+        """Test that an L2 hit is copied into L1 (read-through)."""
+        l1, l2 = MemoryBackend(), MemoryBackend()
+        await l2.set("key", "Shared response")
+        cache = LLMCache(l1=l1, l2=l2)
+
+        assert await cache.get("key") == "Shared response"
+        assert await l1.get("key") == "Shared response"
+
+    async def test_set_writes_all_tiers(self):
+        """Test that set stores the response in both L1 and L2 (write-through)."""
+        l1, l2 = MemoryBackend(), MemoryBackend()
+        cache = LLMCache(l1=l1, l2=l2)
+        await cache.set("key", "Response")
+
+        assert await l1.get("key") == "Response"
+        assert await l2.get("key") == "Response"
+
+    async def test_delete_removes_from_all_tiers(self):
+        """Test that delete clears the key from both tiers."""
+        l1, l2 = MemoryBackend(), MemoryBackend()
+        cache = LLMCache(l1=l1, l2=l2)
+        await cache.set("key", "Response")
+        await cache.delete("key")
+
+        assert await cache.get("key") is None
+
+
+@pytest.fixture
+def mock_redis():
+    """Install a fake redis.asyncio module whose Redis.from_url returns an AsyncMock client."""
+    redis_asyncio = ModuleType("redis.asyncio")
+    redis_asyncio.Redis = Mock()
+    redis_asyncio.Redis.from_url.return_value = AsyncMock()
+    redis_package = ModuleType("redis")
+    redis_package.asyncio = redis_asyncio
+    with patch.dict("sys.modules", {"redis": redis_package, "redis.asyncio": redis_asyncio}):
+        yield redis_asyncio.Redis
+
+
+class TestRedisBackend:
+    """Test cases for RedisBackend class."""
+
+    async def test_get_decodes_stored_value(self, mock_redis):
+        """Test that stored values are decoded from JSON."""
+        backend = RedisBackend("redis://localhost:6379/0")
+        client = mock_redis.from_url.return_value
+        client.get.return_value = orjson.dumps("Cached response")
+
+        assert await backend.get("key") == "Cached response"
+        mock_redis.from_url.assert_called_once_with("redis://localhost:6379/0")
+        client.get.assert_awaited_once_with("key")
+
+    async def test_get_miss_returns_none(self, mock_redis):
+        """Test that a missing key returns None."""
+        backend = RedisBackend("redis://localhost:6379/0")
+        mock_redis.from_url.return_value.get.return_value = None
+
+        assert await backend.get("missing") is None
+
+    async def test_set_encodes_value_with_ttl(self, mock_redis):
+        """Test that values are stored as JSON with the configured expiry."""
+        backend = RedisBackend("redis://localhost:6379/0", ttl=60)
+
+        await backend.set("key", "Response")
+
+        mock_redis.from_url.return_value.set.assert_awaited_once_with("key", orjson.dumps("Response"), ex=60)
+
+    async def test_delete_removes_key(self, mock_redis):
+        """Test that delete is forwarded to Redis."""
+        backend = RedisBackend("redis://localhost:6379/0")
+
+        await backend.delete("key")
+
+        mock_redis.from_url.return_value.delete.assert_awaited_once_with("key")
+
+
+class TestCreateLLMCache:
+    """Test cases for create_llm_cache function."""
+
+    @pytest.fixture(autouse=True)
+    def clear_env(self, monkeypatch):
+        """Start each test without any cache configuration in the environment."""
+        for name in ("REDIS_URL", "LLM_CACHE_TTL", "LLM_CACHE_SIZE", "LLM_CACHE_EMBEDDING_MODEL", "LLM_CACHE_SIMILARITY"):
+            monkeypatch.delenv(name, raising=False)
+
+    def test_defaults_without_configuration(self):
+        """Test that an unconfigured cache is an in-process LRU only."""
+        cache = create_llm_cache()
+
+        assert cache.l1.maxsize == 1024
+        assert cache.l2 is None
+        assert cache.embedding_model is None
+        assert cache.similarity_threshold == 0.95
+
+    def test_reads_environment(self, monkeypatch, mock_redis):
+        """Test that every setting is read from the environment."""
+        monkeypatch.setenv("REDIS_URL", "rediss://:key@cache.redis.cache.windows.net:6380/0")
+        monkeypatch.setenv("LLM_CACHE_TTL", "120")
+        monkeypatch.setenv("LLM_CACHE_SIZE", "16")
+        monkeypatch.setenv("LLM_CACHE_EMBEDDING_MODEL", "azure/text-embedding-3-small")
+        monkeypatch.setenv("LLM_CACHE_SIMILARITY", "0.9")
+
+        cache = create_llm_cache()
+
+        assert cache.l1.maxsize == 16
+        assert isinstance(cache.l2, RedisBackend)
+        assert cache.l2.ttl == 120
+        mock_redis.from_url.assert_called_once_with("rediss://:key@cache.redis.cache.windows.net:6380/0")
+        assert cache.embedding_model == "azure/text-embedding-3-small"
+        assert cache.similarity_threshold == 0.9
+
+    def test_empty_embedding_model_disables_semantic_tier(self, monkeypatch):
+        """Test that an empty embedding model setting leaves the semantic tier off."""
+        monkeypatch.setenv("LLM_CACHE_EMBEDDING_MODEL", "")
+
+        assert create_llm_cache().embedding_model is None
+
+
+class TestCoalesce:
+    """Test cases for LLMCache.coalesce request coalescing."""
+
+    async def test_concurrent_requests_share_one_call(self):
+        """Test that identical in-flight requests run the factory once."""
+        cache = LLMCache()
+        calls = []
+        release = asyncio.Event()
+
+        async def factory():
+            calls.append(1)
+            await release.wait()
+            return "Shared response"
+
+        leader = asyncio.create_task(cache.coalesce("key", factory))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(cache.coalesce("key", factory))
+        await asyncio.sleep(0)
+        release.set()
+
+        assert await leader == ("Shared response", False)
+        assert await follower == ("Shared response", True)
+        assert len(calls) == 1
+
+    async def test_failure_propagates_to_waiters(self):
+        """Test that a failed leader raises in every waiter and clears the in-flight entry."""
+        cache = LLMCache()
+        release = asyncio.Event()
+
+        async def factory():
+            await release.wait()
+            raise RuntimeError("API Error")
+
+        leader = asyncio.create_task(cache.coalesce("key", factory))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(cache.coalesce("key", factory))
+        await asyncio.sleep(0)
+        release.set()
+
+        with pytest.raises(RuntimeError):
+            await leader
+        with pytest.raises(RuntimeError):
+            await follower
+        assert "key" not in cache._inflight
+
+    async def test_cancelled_waiter_does_not_affect_leader(self):
+        """Test that cancelling a waiter leaves the leader and other waiters with the result."""
+        cache = LLMCache()
+        release = asyncio.Event()
+
+        async def factory():
+            await release.wait()
+            return "Shared response"
+
+        leader = asyncio.create_task(cache.coalesce("key", factory))
+        await asyncio.sleep(0)
+        cancelled = asyncio.create_task(cache.coalesce("key", factory))
+        follower = asyncio.create_task(cache.coalesce("key", factory))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        release.set()
+
+        assert await leader == ("Shared response", False)
+        assert await follower == ("Shared response", True)
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+
+    async def test_cancelled_leader_raises_in_waiters(self):
+        """Test that cancelling the leader surfaces an ordinary error in waiters."""
+        cache = LLMCache()
+
+        async def factory():
+            await asyncio.Event().wait()
+
+        leader = asyncio.create_task(cache.coalesce("key", factory))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(cache.coalesce("key", factory))
+        await asyncio.sleep(0)
+        leader.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        with pytest.raises(RuntimeError, match="cancelled"):
+            await follower
+        assert "key" not in cache._inflight
+
+
+class TestSemanticCache:
+    """Test cases for the semantic (embedding) tier of LLMCache."""
+
+    def setup_method(self):
+        """Set up test data for each test method."""
+        np = pytest.importorskip("numpy")
+        self.embeddings = {
+            "What is the leave policy?": np.array([1.0, 0.0, 0.0], dtype=np.float32),
+            "Tell me the leave policy": np.array([0.99, 0.141, 0.0], dtype=np.float32),
+            "How do I file a claim?": np.array([0.0, 1.0, 0.0], dtype=np.float32),
+        }
+
+    def make_cache(self) -> LLMCache:
+        """Build a cache whose embedding call is served from the test data."""
+        cache = LLMCache(embedding_model="azure/text-embedding-3-small")
+
+        async def fake_embed(text):
+            vector = self.embeddings[text]
+            return vector / (vector @ vector) ** 0.5
+
+        cache._embed = fake_embed
+        return cache
+
+    async def test_paraphrase_hits_semantic_tier(self):
+        """Test that a paraphrased prompt reuses the stored response."""
+        cache = self.make_cache()
+        assert await cache.get("k1", prompt="What is the leave policy?", namespace="azure/gpt-4") is None
+        await cache.set("k1", "Leave policy answer", prompt="What is the leave policy?", namespace="azure/gpt-4")
+
+        result = await cache.get("k2", prompt="Tell me the leave policy", namespace="azure/gpt-4")
+
+        assert result == "Leave policy answer"
+
+    async def test_unrelated_prompt_misses(self):
+        """Test that a dissimilar prompt is not served from the semantic tier."""
+        cache = self.make_cache()
+        await cache.set("k1", "Leave policy answer", prompt="What is the leave policy?", namespace="azure/gpt-4")
+
+        assert await cache.get("k2", prompt="How do I file a claim?", namespace="azure/gpt-4") is None
+
+    async def test_namespaces_are_isolated(self):
+        """Test that semantic matches do not cross model deployments."""
+        cache = self.make_cache()
+        await cache.set("k1", "Leave policy answer", prompt="What is the leave policy?", namespace="azure/gpt-4")
+
+        assert await cache.get("k2", prompt="Tell me the leave policy", namespace="azure/o3-mini") is None
+
+    async def test_evicts_least_recently_used_namespace(self):
+        """Test that at most max_namespaces semantic indexes are kept."""
+        cache = self.make_cache()
+        cache.max_namespaces = 1
+        await cache.set("k1", "Leave policy answer", prompt="What is the leave policy?", namespace="first")
+        await cache.set("k2", "Claim answer", prompt="How do I file a claim?", namespace="second")
+
+        assert list(cache._indexes) == ["second"]
+        assert await cache.get("k3", prompt="Tell me the leave policy", namespace="first") is None
+
+    async def test_semantic_index_failure_keeps_response(self):
+        """Test that a failed semantic index write is skipped without losing the exact-match entry."""
+        np = pytest.importorskip("numpy")
+        cache = self.make_cache()
+        await cache.set("k1", "Leave policy answer", prompt="What is the leave policy?", namespace="azure/gpt-4")
+        # An embedding with a different dimension cannot be added to the existing index
+        self.embeddings["How do I file a claim?"] = np.array([0.0, 1.0], dtype=np.float32)
+
+        await cache.set("k2", "Claim answer", prompt="How do I file a claim?", namespace="azure/gpt-4")
+
+        assert await cache.get("k2") == "Claim answer"
+
+    async def test_time_sensitive_prompt_skips_semantic_tier(self):
+        """Test that prompts mentioning the current time are never matched semantically."""
+        cache = self.make_cache()
+
+        assert cache._use_semantic("What is the leave policy?") is True
+        assert cache._use_semantic("What is on the schedule today?") is False
+
+    def test_semantic_index_overwrites_oldest_when_full(self):
+        """Test that the index keeps at most max_entries prompts."""
+        np = pytest.importorskip("numpy")
+        index = SemanticIndex(max_entries=2)
+        index.add(np.array([1.0, 0.0], dtype=np.float32), "first")
+        index.add(np.array([0.0, 1.0], dtype=np.float32), "second")
+        index.add(np.array([1.0, 0.0], dtype=np.float32), "third")
+
+        similarity, response = index.search(np.array([1.0, 0.0], dtype=np.float32))
+
+        assert response == "third"
+        assert similarity == pytest.approx(1.0)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -2,233 +2,178 @@
 # Tests configuration file validation and display functionality
 
 import pytest
+import io
+import re
 import json
-import os
-import tempfile
-from unittest.mock import patch, mock_open
-import sys
+import orjson
+from types import MappingProxyType, SimpleNamespace
+
+
+# ============================================================================
+# CONFIGURATION PAYLOADS (shared across tests; do not mutate)
+# ============================================================================
+
+# Keyword arguments test_config_file() passes to json.dumps
+DUMP_KWARGS = {"ensure_ascii": False}
+
+VALID_CONFIG = (
+    MappingProxyType({
+        "model_deployment": "azure/gpt-4",
+        "description": "Azure GPT-4 model",
+        "api_key": "test-key-1",
+        "api_endpoint": "https://test1.openai.azure.com"
+    }),
+    MappingProxyType({
+        "model_deployment": "foundry/gpt-4.1",
+        "description": "Foundry GPT-4.1 model",
+        "api_key": "test-key-2",
+        "api_endpoint": "https://test2.foundry.azure.com"
+    })
+)
+
+# What test_config_file() prints for VALID_CONFIG
+VALID_CONFIG_JSON = json.dumps([dict(model) for model in VALID_CONFIG], **DUMP_KWARGS)
+
+UNICODE_CONFIG = [
+    {
+        "model_deployment": "azure/gpt-4",
+        "description": "Azure GPT-4 with émojis 🤖",
+        "api_key": "tëst-kéy-1"
+    }
+]
+
+NESTED_CONFIG = [
+    {
+        "model_deployment": "azure/gpt-4",
+        "settings": {
+            "temperature": 0.7,
+            "max_tokens": 1000,
+            "advanced": {
+                "top_p": 0.9,
+                "frequency_penalty": 0.0
+            }
+        },
+        "endpoints": ["https://api1.com", "https://api2.com"]
+    }
+]
+
+SPECIAL_CONFIG = [
+    {
+        "model_deployment": "azure/gpt-4",
+        "description": 'Model with "quotes" and \\backslashes\\ and \n newlines',
+        "api_key": "key-with-special-chars!@#$%^&*()"
+    }
+]
+
+
+@pytest.fixture(scope="session")
+def valid_config():
+    """Fixture providing VALID_CONFIG as a plain list of dicts (do not mutate)."""
+    return list(map(dict, VALID_CONFIG))
+
+
+# Expected error message per failure kind
+_ERR_PATTERNS = {kind: re.compile(re.escape(message)) for kind, message in {
+    "not_found": "Error: Could not find the config file at ",
+    "invalid_json": "Error: Invalid JSON format in config file - Invalid JSON",
+    "unexpected_error": "Error: An unexpected error occurred - Unexpected error",
+    "permission_error": "Error: An unexpected error occurred - Permission denied",
+}.items()}
 
-# Add the parent directory to the path to import the test_config module
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Targets stubbed by the tests below
+_OPEN = "builtins.open"
+_JSON_LOAD = "utils.test_config.json.load"
+_DIRNAME = "utils.test_config.os.path.dirname"
+_JOIN = "utils.test_config.os.path.join"
 
-from utils.test_config import test_config_file
+
+def _single_printed(capsys) -> str:
+    """Return the only line printed since the last capture, asserting exactly one was printed."""
+    out = capsys.readouterr().out
+    assert out.count("\n") == 1
+    return out.rstrip("\n")
+
+
+def fake_open(payload: bytes):
+    """Build an open() stub returning a fresh in-memory file with `payload` on every call."""
+    return lambda *args, **kwargs: io.BytesIO(payload)
+
+
+def raising(exc):
+    """Build a stub that raises `exc` whenever it is called."""
+    def stub(*args, **kwargs):
+        raise exc
+    return stub
+
+
+@pytest.fixture
+def patched_io(monkeypatch):
+    """
+    Stub open() used by test_config_file() with plain callables.
+    
+    `load` serves a payload from an in-memory file that the real json.load
+    parses; `fail_open` and `fail_load` make open()/json.load raise. Printed
+    output is read through pytest's capsys fixture.
+    """
+    monkeypatch.setattr(_OPEN, fake_open(b"{}"))
+    return SimpleNamespace(
+        load=lambda payload: monkeypatch.setattr(_OPEN, fake_open(orjson.dumps(payload))),
+        fail_open=lambda exc: monkeypatch.setattr(_OPEN, raising(exc)),
+        fail_load=lambda exc: monkeypatch.setattr(_JSON_LOAD, raising(exc)),
+    )
 
 
 class TestTestConfigFile:
     """Test cases for test_config_file function."""
     
-    def setup_method(self):
-        """Set up test data for each test method."""
-        self.valid_config = [
-            {
-                "model_deployment": "azure/gpt-4",
-                "description": "Azure GPT-4 model",
-                "api_key": "test-key-1",
-                "api_endpoint": "https://test1.openai.azure.com"
-            },
-            {
-                "model_deployment": "foundry/gpt-4.1",
-                "description": "Foundry GPT-4.1 model",
-                "api_key": "test-key-2",
-                "api_endpoint": "https://test2.foundry.azure.com"
-            }
-        ]
-        
-        self.invalid_json = '{"model_deployment": "azure/gpt-4", "incomplete": true'
-
-    @patch('builtins.open', mock_open())
-    @patch('builtins.print')
-    @patch('utils.test_config.json.load')
-    def test_config_file_valid_json(self, mock_json_load, mock_print):
-        """Test test_config_file with valid JSON configuration."""
-        mock_json_load.return_value = self.valid_config
+    @pytest.mark.parametrize("config,expected", [
+        ([], "[]"),
+        (list(map(dict, VALID_CONFIG)), VALID_CONFIG_JSON),
+        (UNICODE_CONFIG, json.dumps(UNICODE_CONFIG, **DUMP_KWARGS)),
+        (NESTED_CONFIG, json.dumps(NESTED_CONFIG, **DUMP_KWARGS)),
+        (SPECIAL_CONFIG, json.dumps(SPECIAL_CONFIG, **DUMP_KWARGS)),
+    ], ids=["empty", "valid", "unicode", "nested", "special"])
+    def test_config_file_prints_config(self, test_config_file, patched_io, capsys, config, expected):
+        """Test test_config_file prints the loaded configuration as JSON."""
+        patched_io.load(config)
         
         test_config_file()
         
-        # Verify file was opened and JSON was loaded
-        mock_json_load.assert_called_once()
-        
         # Verify JSON was printed
-        mock_print.assert_called_once()
-        printed_output = mock_print.call_args[0][0]
-        
-        # The output should be a JSON string representation of the config
-        parsed_output = json.loads(printed_output)
-        assert parsed_output == self.valid_config
-
-    @patch('builtins.open')
-    @patch('builtins.print')
-    def test_config_file_not_found(self, mock_print, mock_open_func):
-        """Test test_config_file when configuration file is not found."""
-        mock_open_func.side_effect = FileNotFoundError("File not found")
-        
-        test_config_file()
-        
-        # Verify error message was printed
-        mock_print.assert_called_once()
-        error_message = mock_print.call_args[0][0]
-        assert "Error: Could not find the config file" in error_message
-
-    @patch('builtins.open', mock_open())
-    @patch('builtins.print')
-    @patch('utils.test_config.json.load')
-    def test_config_file_invalid_json(self, mock_json_load, mock_print):
-        """Test test_config_file with invalid JSON format."""
-        mock_json_load.side_effect = json.JSONDecodeError("Invalid JSON", "doc", 0)
-        
-        test_config_file()
+        printed_output = _single_printed(capsys)
         
-        # Verify error message was printed
-        mock_print.assert_called_once()
-        error_message = mock_print.call_args[0][0]
-        assert "Error: Invalid JSON format in config file" in error_message
-
-    @patch('builtins.open', mock_open())
-    @patch('builtins.print')
-    @patch('utils.test_config.json.load')
-    def test_config_file_unexpected_error(self, mock_json_load, mock_print):
-        """Test test_config_file with unexpected error."""
-        mock_json_load.side_effect = Exception("Unexpected error")
+        # The output should be the JSON string representation of the config
+        assert printed_output == expected
+
+    @pytest.mark.parametrize("kind,fail,exc", [
+        ("not_found", "fail_open", FileNotFoundError("File not found")),
+        ("invalid_json", "fail_load", json.JSONDecodeError("Invalid JSON", "doc", 0)),
+        ("unexpected_error", "fail_load", Exception("Unexpected error")),
+        ("permission_error", "fail_open", PermissionError("Permission denied")),
+    ], ids=["not_found", "invalid_json", "unexpected_error", "permission_error"])
+    def test_config_file_reports_errors(self, test_config_file, patched_io, capsys, kind, fail, exc):
+        """Test test_config_file prints an error when the file cannot be opened or parsed."""
+        getattr(patched_io, fail)(exc)
         
         test_config_file()
         
         # Verify error message was printed
-        mock_print.assert_called_once()
-        error_message = mock_print.call_args[0][0]
-        assert "Error: An unexpected error occurred" in error_message
-        assert "Unexpected error" in error_message
-
-    @patch('builtins.open', mock_open())
-    @patch('builtins.print')
-    @patch('utils.test_config.json.load')
-    def test_config_file_empty_config(self, mock_json_load, mock_print):
-        """Test test_config_file with empty configuration."""
-        mock_json_load.return_value = []
-        
-        test_config_file()
-        
-        # Verify empty list was printed
-        mock_print.assert_called_once()
-        printed_output = mock_print.call_args[0][0]
-        assert printed_output == "[]"
-
-    @patch('builtins.open', mock_open())
-    @patch('builtins.print')
-    @patch('utils.test_config.json.load')
-    def test_config_file_with_unicode_content(self, mock_json_load, mock_print):
-        """Test test_config_file with unicode content in configuration."""
-        unicode_config = [
-            {
-                "model_deployment": "azure/gpt-4",
-                "description": "Azure GPT-4 with émojis 🤖",
-                "api_key": "tëst-kéy-1"
-            }
-        ]
-        mock_json_load.return_value = unicode_config
-        
-        test_config_file()
-        
-        # Verify unicode content was handled correctly
-        mock_print.assert_called_once()
-        printed_output = mock_print.call_args[0][0]
-        parsed_output = json.loads(printed_output)
-        assert parsed_output == unicode_config
-        assert "émojis 🤖" in printed_output
-
-    @patch('utils.test_config.os.path.join')
-    @patch('utils.test_config.os.path.dirname')
-    @patch('builtins.open', mock_open())
-    @patch('builtins.print')
-    @patch('utils.test_config.json.load')
-    def test_config_file_path_construction(self, mock_json_load, mock_print, 
-                                          mock_dirname, mock_join):
+        error_message = _single_printed(capsys)
+        assert _ERR_PATTERNS[kind].match(error_message)
+
+    def test_config_file_path_construction(self, test_config_file, valid_config, patched_io, monkeypatch):
         """Test that config file path is constructed correctly."""
-        mock_dirname.side_effect = ["/utils", "/project"]  # Two calls to dirname
-        mock_join.return_value = "/project/llm_config/llm_config.json"
-        mock_json_load.return_value = self.valid_config
+        dirnames = iter(["/utils", "/project"])  # Two calls to dirname
+        joined = []
+        monkeypatch.setattr(_DIRNAME, lambda path: next(dirnames))
+        monkeypatch.setattr(_JOIN, lambda *parts: joined.append(parts) or "/".join(parts))
+        patched_io.load(valid_config)
         
         test_config_file()
         
         # Verify path construction
-        assert mock_dirname.call_count == 2
-        mock_join.assert_called_once_with("/project", 'llm_config/llm_config.json')
-
-    def test_config_file_main_execution(self):
-        """Test that test_config_file runs when executed as main."""
-        # This test verifies the if __name__ == "__main__" block
-        with patch('utils.test_config.test_config_file') as mock_test_config:
-            # Import the module to trigger the main execution
-            import utils.test_config
-            
-            # We can't easily test the main execution without running the actual script,
-            # but we can verify the function exists and is callable
-            assert callable(utils.test_config.test_config_file)
-
-    @patch('builtins.open')
-    @patch('builtins.print')
-    def test_config_file_permission_error(self, mock_print, mock_open_func):
-        """Test test_config_file when file permission is denied."""
-        mock_open_func.side_effect = PermissionError("Permission denied")
-        
-        test_config_file()
-        
-        # Verify error message was printed
-        mock_print.assert_called_once()
-        error_message = mock_print.call_args[0][0]
-        assert "Error: An unexpected error occurred" in error_message
-        assert "Permission denied" in error_message
-
-    @patch('builtins.open', mock_open())
-    @patch('builtins.print')
-    @patch('utils.test_config.json.load')
-    def test_config_file_nested_json_structure(self, mock_json_load, mock_print):
-        """Test test_config_file with nested JSON structure."""
-        nested_config = [
-            {
-                "model_deployment": "azure/gpt-4",
-                "settings": {
-                    "temperature": 0.7,
-                    "max_tokens": 1000,
-                    "advanced": {
-                        "top_p": 0.9,
-                        "frequency_penalty": 0.0
-                    }
-                },
-                "endpoints": ["https://api1.com", "https://api2.com"]
-            }
-        ]
-        mock_json_load.return_value = nested_config
-        
-        test_config_file()
-        
-        # Verify nested structure was handled correctly
-        mock_print.assert_called_once()
-        printed_output = mock_print.call_args[0][0]
-        parsed_output = json.loads(printed_output)
-        assert parsed_output == nested_config
-        assert parsed_output[0]["settings"]["advanced"]["top_p"] == 0.9
-
-    @patch('builtins.open', mock_open())
-    @patch('builtins.print')
-    @patch('utils.test_config.json.load')
-    def test_config_file_special_characters(self, mock_json_load, mock_print):
-        """Test test_config_file with special characters in JSON."""
-        special_config = [
-            {
-                "model_deployment": "azure/gpt-4",
-                "description": 'Model with "quotes" and \\backslashes\\ and \n newlines',
-                "api_key": "key-with-special-chars!@#$%^&*()"
-            }
-        ]
-        mock_json_load.return_value = special_config
-        
-        test_config_file()
-        
-        # Verify special characters were handled correctly
-        mock_print.assert_called_once()
-        printed_output = mock_print.call_args[0][0]
-        parsed_output = json.loads(printed_output)
-        assert parsed_output == special_config
+        assert next(dirnames, None) is None
+        assert joined == [("/project", 'llm_config/llm_config.json')]
 
 
 if __name__ == "__main__":
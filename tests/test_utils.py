@@ -2,16 +2,11 @@
 # Tests session management, logging, message formatting, model configuration, and chat settings
 
 import pytest
-import os
 import json
 import base64
 import tempfile
 from unittest.mock import Mock, patch, MagicMock, mock_open, AsyncMock
 import chainlit as cl
-import sys
-
-# Add the parent directory to the path to import the utils module
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from utils.utils import (
     truncate,
@@ -20,7 +15,11 @@ from utils.utils import (
     get_llm_models,
     append_message,
     init_settings,
-    get_llm_details
+    get_llm_details,
+    get_deployment_index,
+    get_agents_client,
+    get_azure_credential,
+    clear_llm_cache
 )
 
 
@@ -74,18 +73,17 @@ class TestAddContext:
         """Set up test data for each test method."""
         self.mock_record = {"extra": {}}
 
-    @patch('utils.utils.cl.user_session')
-    def test_add_context_with_full_user_data(self, mock_user_session):
+    def test_add_context_with_full_user_data(self, fake_session):
         """Test add_context with complete user information."""
         # Mock user with metadata
         mock_user = Mock()
         mock_user.metadata = {"id": "user123"}
         mock_user.identifier = "test@example.com"
         
-        mock_user_session.get.side_effect = lambda key, default=None: {
+        fake_session.data.update({
             "id": "session123",
             "user": mock_user
-        }.get(key, default)
+        })
         
         result = add_context(self.mock_record)
         
@@ -93,18 +91,17 @@ class TestAddContext:
         assert self.mock_record["extra"]["session_id"] == "session123"
         assert self.mock_record["extra"]["user_id"] == "user123"
 
-    @patch('utils.utils.cl.user_session')
-    def test_add_context_with_user_identifier_only(self, mock_user_session):
+    def test_add_context_with_user_identifier_only(self, fake_session):
         """Test add_context with user having only identifier."""
         # Mock user without metadata but with identifier
         mock_user = Mock()
         mock_user.metadata = {}
         mock_user.identifier = "test@example.com"
         
-        mock_user_session.get.side_effect = lambda key, default=None: {
+        fake_session.data.update({
             "id": "session123",
             "user": mock_user
-        }.get(key, default)
+        })
         
         result = add_context(self.mock_record)
         
@@ -112,13 +109,12 @@ class TestAddContext:
         assert self.mock_record["extra"]["session_id"] == "session123"
         assert self.mock_record["extra"]["user_id"] == "test@example.com"
 
-    @patch('utils.utils.cl.user_session')
-    def test_add_context_with_no_user(self, mock_user_session):
+    def test_add_context_with_no_user(self, fake_session):
         """Test add_context with no user information."""
-        mock_user_session.get.side_effect = lambda key, default=None: {
+        fake_session.data.update({
             "id": "session123",
             "user": None
-        }.get(key, default)
+        })
         
         result = add_context(self.mock_record)
         
@@ -126,12 +122,11 @@ class TestAddContext:
         assert self.mock_record["extra"]["session_id"] == "session123"
         assert self.mock_record["extra"]["user_id"] == "anonymous"
 
-    @patch('utils.utils.cl.user_session')
-    def test_add_context_with_unknown_session(self, mock_user_session):
+    def test_add_context_with_unknown_session(self, fake_session):
         """Test add_context with unknown session."""
-        mock_user_session.get.side_effect = lambda key, default=None: {
-            "user": None
-        }.get(key, default)  # Note: "id" key is missing, so default will be used
+        fake_session.data.update({
+            "user": None  # Note: "id" key is missing, so default will be used
+        })
         
         result = add_context(self.mock_record)
         
@@ -157,20 +152,10 @@ class TestGetLogger:
 class TestGetLlmModels:
     """Test cases for get_llm_models function."""
     
-    def setup_method(self):
-        """Set up test data for each test method."""
-        self.sample_config = [
-            {
-                "model_deployment": "azure/gpt-4",
-                "description": "Azure GPT-4 model",
-                "api_key": "test-key-1"
-            },
-            {
-                "model_deployment": "foundry/gpt-4.1",
-                "description": "Foundry GPT-4.1 model",
-                "api_key": "test-key-2"
-            }
-        ]
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        """Each test loads its own configuration."""
+        clear_llm_cache()
 
     @patch.dict('os.environ', {'LLM_CONFIG': '[]'})
     def test_get_llm_models_from_env_empty(self):
@@ -182,17 +167,27 @@ class TestGetLlmModels:
 
     @patch.dict('os.environ', {'LLM_CONFIG': ''}, clear=True)
     @patch('builtins.open', mock_open(read_data='[]'))
-    def test_get_llm_models_from_file_when_no_env(self):
+    def test_get_llm_models_from_file_when_no_env(self, sample_llm_models):
         """Test get_llm_models falls back to file when no env var."""
         with patch('utils.utils.json.loads') as mock_json_loads:
             mock_json_loads.side_effect = Exception("No env var")
             
             with patch('utils.utils.json.load') as mock_json_load:
-                mock_json_load.return_value = self.sample_config
+                mock_json_load.return_value = sample_llm_models
                 
                 result = get_llm_models()
                 
-                assert result == self.sample_config
+                assert result == sample_llm_models
+
+    @patch.dict('os.environ', {'LLM_CONFIG': '[{"model_deployment": "test/model"}]'})
+    def test_get_llm_models_is_cached(self):
+        """Test that the configuration is parsed once and reused."""
+        with patch('utils.utils.json.loads', wraps=json.loads) as mock_json_loads:
+            first = get_llm_models()
+            second = get_llm_models()
+        
+        assert first is second
+        mock_json_loads.assert_called_once()
 
     @patch.dict('os.environ', {'LLM_CONFIG': '[{"model_deployment": "test/model"}]'})
     def test_get_llm_models_from_env_valid_json(self):
@@ -214,33 +209,52 @@ class TestGetLlmModels:
         assert result[0]["model_deployment"] == "fallback/model"
 
 
+@pytest.fixture
+def mock_settings():
+    """Fixture providing chat settings for an Azure profile (fresh per test)."""
+    return {
+        "instructions": "You are a helpful AI assistant.",
+        "model_provider": "azure"
+    }
+
+
+@pytest.fixture(scope="session")
+def image_element():
+    """Fixture providing an uploaded PNG image element (read-only)."""
+    element = Mock(mime="image/png", path="/path/to/image.png")
+    element.name = "image.png"  # Mock(name=...) would only set the repr name
+    return element
+
+
+@pytest.fixture(scope="session")
+def text_element():
+    """Fixture providing an uploaded text file element (read-only)."""
+    element = Mock(mime="text/plain", path="test_file.txt")  # Use relative path to test file
+    element.name = "test_file.txt"
+    return element
+
+
+@pytest.fixture(scope="session")
+def long_history():
+    """Fixture providing a 15-message chat history, built once (copy before passing to append_message)."""
+    return [
+        {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": [{"type": "text", "text": f"Message {i}"}]
+        }
+        for i in range(15)
+    ]
+
+
 class TestAppendMessage:
     """Test cases for append_message function."""
-    
-    def setup_method(self):
-        """Set up test data for each test method."""
-        self.mock_settings = {
-            "instructions": "You are a helpful AI assistant.",
-            "model_provider": "azure"
-        }
-        
-        self.mock_image_element = Mock()
-        self.mock_image_element.mime = "image/png"
-        self.mock_image_element.path = "/path/to/image.png"
-        self.mock_image_element.name = "image.png"
-        
-        self.mock_text_element = Mock()
-        self.mock_text_element.mime = "text/plain"
-        self.mock_text_element.path = "test_file.txt"  # Use relative path to test file
-        self.mock_text_element.name = "test_file.txt"
 
-    @patch('utils.utils.cl.user_session')
-    def test_append_message_user_basic(self, mock_user_session):
+    def test_append_message_user_basic(self, mock_settings, fake_session):
         """Test append_message for basic user message."""
-        mock_user_session.get.side_effect = lambda key, default=None: {
-            "chat_settings": self.mock_settings,
+        fake_session.data.update({
+            "chat_settings": mock_settings,
             "chat_history": []
-        }.get(key, default)
+        })
         
         result = append_message("user", "Hello world")
         
@@ -249,13 +263,12 @@ class TestAppendMessage:
         assert result[1]["role"] == "user"
         assert result[1]["content"][0]["text"] == "Hello world"
 
-    @patch('utils.utils.cl.user_session')
-    def test_append_message_assistant_basic(self, mock_user_session):
+    def test_append_message_assistant_basic(self, mock_settings, fake_session):
         """Test append_message for basic assistant message."""
-        mock_user_session.get.side_effect = lambda key, default=None: {
-            "chat_settings": self.mock_settings,
+        fake_session.data.update({
+            "chat_settings": mock_settings,
             "chat_history": []
-        }.get(key, default)
+        })
         
         result = append_message("assistant", "Hello! How can I help you?")
         
@@ -264,18 +277,17 @@ class TestAppendMessage:
         assert result[1]["role"] == "assistant"
         assert result[1]["content"][0]["text"] == "Hello! How can I help you?"
 
-    @patch('utils.utils.cl.user_session')
     @patch('builtins.open', mock_open(read_data=b'fake_image_data'))
     @patch('utils.utils.base64.b64encode')
-    def test_append_message_with_image_element(self, mock_b64_encode, mock_user_session):
+    def test_append_message_with_image_element(self, mock_b64_encode, mock_settings, image_element, fake_session):
         """Test append_message with image element."""
         mock_b64_encode.return_value = b'encoded_image_data'
-        mock_user_session.get.side_effect = lambda key, default=None: {
-            "chat_settings": self.mock_settings,
+        fake_session.data.update({
+            "chat_settings": mock_settings,
             "chat_history": []
-        }.get(key, default)
+        })
         
-        result = append_message("user", "Look at this image", [self.mock_image_element])
+        result = append_message("user", "Look at this image", [image_element])
         
         assert len(result) == 2
         assert result[1]["role"] == "user"
@@ -283,90 +295,60 @@ class TestAppendMessage:
         assert result[1]["content"][0]["text"] == "Look at this image"
         assert result[1]["content"][1]["type"] == "image_url"
 
-    @patch('utils.utils.cl.user_session')
     @patch('utils.utils.md.convert')
-    def test_append_message_with_text_element(self, mock_md_convert, mock_user_session):
+    def test_append_message_with_text_element(self, mock_md_convert, mock_settings, text_element, fake_session):
         """Test append_message with text file element."""
         mock_result = Mock()
         mock_result.text_content = "File content here"
         mock_md_convert.return_value = mock_result
         
-        mock_user_session.get.side_effect = lambda key, default=None: {
-            "chat_settings": self.mock_settings,
+        fake_session.data.update({
+            "chat_settings": mock_settings,
             "chat_history": []
-        }.get(key, default)
+        })
         
-        result = append_message("user", "Check this file", [self.mock_text_element])
+        result = append_message("user", "Check this file", [text_element])
         
         assert len(result) == 2
         assert result[1]["role"] == "user"
         assert len(result[1]["content"]) == 2  # Text + file content
         assert "<file_name:test_file.txt>" in result[1]["content"][1]["text"]
 
-    @patch('utils.utils.cl.user_session')
-    def test_append_message_with_foundry_provider(self, mock_user_session):
+    def test_append_message_with_foundry_provider(self, mock_settings, text_element, fake_session):
         """Test append_message with foundry provider."""
-        foundry_settings = self.mock_settings.copy()
-        foundry_settings["model_provider"] = "foundry"
+        foundry_settings = {**mock_settings, "model_provider": "foundry"}
         
-        mock_user_session.get.side_effect = lambda key, default=None: {
+        fake_session.data.update({
             "chat_settings": foundry_settings,
             "chat_history": []
-        }.get(key, default)
+        })
         
-        result = append_message("user", "Test message", [self.mock_text_element])
+        result = append_message("user", "Test message", [text_element])
         
         # With foundry, files should be uploaded, not converted to markdown
         assert len(result) == 2
         assert result[1]["role"] == "user"
-        mock_user_session.set.assert_called()
-
-    @patch('utils.utils.cl.user_session')
-    def test_append_message_chat_history_pruning(self, mock_user_session):
-        """Test that chat history is pruned to 10 messages."""
-        # Create a long chat history (15 messages)
-        long_history = []
-        for i in range(15):
-            long_history.append({
-                "role": "user" if i % 2 == 0 else "assistant",
-                "content": [{"type": "text", "text": f"Message {i}"}]
-            })
-        
-        mock_user_session.get.side_effect = lambda key, default=None: {
-            "chat_settings": self.mock_settings,
-            "chat_history": long_history
-        }.get(key, default)
-        
-        result = append_message("assistant", "New response")
-        
-        # Should have system prompt + 10 most recent messages
-        assert len(result) == 11
-        # Verify pruning happened by checking the saved history
-        calls = mock_user_session.set.call_args_list
-        history_call = next(call for call in calls if call[0][0] == "chat_history")
-        saved_history = history_call[0][1]
-        assert len(saved_history) == 10
-
-    @patch('utils.utils.cl.user_session')
-    def test_append_message_no_pruning_for_user(self, mock_user_session):
-        """Test that chat history is not pruned for user messages."""
-        # Create a long chat history (15 messages)
-        long_history = []
-        for i in range(15):
-            long_history.append({
-                "role": "user" if i % 2 == 0 else "assistant",
-                "content": [{"type": "text", "text": f"Message {i}"}]
-            })
-        
-        mock_user_session.get.side_effect = lambda key, default=None: {
-            "chat_settings": self.mock_settings,
-            "chat_history": long_history
-        }.get(key, default)
-        
-        result = append_message("user", "New user message")
-        
-        # Should have system prompt + all 16 messages (15 + new one)
-        assert len(result) == 17
+        assert fake_session.data["file_uploads"] == [{
+            "name": "test_file.txt", "mime": "text/plain", "path": "test_file.txt", "base64": None
+        }]
+
+    @pytest.mark.parametrize("role,expected_len,expected_saved", [
+        ("assistant", 11, 10),  # Pruned to the 10 most recent messages
+        ("user", 17, 16),  # Not pruned: all 15 messages + the new one
+    ], ids=["assistant_prunes", "user_keeps_all"])
+    def test_append_message_chat_history_pruning(self, mock_settings, long_history, fake_session,
+                                                 role, expected_len, expected_saved):
+        """Test that chat history is pruned to 10 messages only after assistant messages."""
+        fake_session.data.update({
+            "chat_settings": mock_settings,
+            "chat_history": list(long_history)  # append_message appends in place
+        })
+        
+        result = append_message(role, "New message")
+        
+        # Should have system prompt + the saved history
+        assert len(result) == expected_len
+        assert len(fake_session.data["chat_history"]) == expected_saved
 
 
 class TestInitSettings:
@@ -428,104 +410,161 @@ class TestInitSettings:
 class TestGetLlmDetails:
     """Test cases for get_llm_details function."""
     
-    def setup_method(self):
-        """Set up test data for each test method."""
-        self.mock_models = [
-            {
-                "model_deployment": "azure/gpt-4",
-                "api_key": "test-key-1",
-                "api_endpoint": "https://test1.openai.azure.com"
-            },
-            {
-                "model_deployment": "foundry/gpt-4.1",
-                "api_key": "test-key-2",
-                "api_endpoint": "https://test2.foundry.azure.com"
-            }
-        ]
-
-    @patch('utils.utils.cl.user_session')
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        """Each test patches its own model list."""
+        clear_llm_cache()
+
     @patch('utils.utils.get_llm_models')
-    def test_get_llm_details_azure_model(self, mock_get_llm_models, mock_user_session):
+    def test_get_llm_details_azure_model(self, mock_get_llm_models, sample_llm_models, fake_session):
         """Test get_llm_details for Azure model."""
-        mock_get_llm_models.return_value = self.mock_models
+        mock_get_llm_models.return_value = sample_llm_models
         
         mock_chat_settings = {"temperature": 0.7}
-        mock_user_session.get.side_effect = lambda key, default=None: {
+        fake_session.data.update({
             "chat_settings": mock_chat_settings,
             "chat_profile": "azure/gpt-4"
-        }.get(key, default)
+        })
         
         result = get_llm_details()
         
         assert result["model_deployment"] == "azure/gpt-4"
-        assert result["api_key"] == "test-key-1"
+        assert result["api_key"] == "test-azure-key-1"
         assert result["api_endpoint"] == "https://test1.openai.azure.com"
         
         # Verify session was updated
-        mock_user_session.set.assert_called_once()
-        set_call = mock_user_session.set.call_args
-        assert set_call[0][0] == "chat_settings"
-        updated_settings = set_call[0][1]
+        updated_settings = fake_session.data["chat_settings"]
         assert updated_settings["model_name"] == "gpt-4"
         assert updated_settings["model_provider"] == "azure"
 
-    @patch('utils.utils.cl.user_session')
     @patch('utils.utils.get_llm_models')
-    def test_get_llm_details_foundry_model(self, mock_get_llm_models, mock_user_session):
+    def test_get_llm_details_foundry_model(self, mock_get_llm_models, sample_llm_models, fake_session):
         """Test get_llm_details for Foundry model."""
-        mock_get_llm_models.return_value = self.mock_models
+        mock_get_llm_models.return_value = sample_llm_models
         
         mock_chat_settings = {"temperature": 0.7}
-        mock_user_session.get.side_effect = lambda key, default=None: {
+        fake_session.data.update({
             "chat_settings": mock_chat_settings,
             "chat_profile": "foundry/gpt-4.1"
-        }.get(key, default)
+        })
         
         result = get_llm_details()
         
         assert result["model_deployment"] == "foundry/gpt-4.1"
-        assert result["api_key"] == "test-key-2"
-        assert result["api_endpoint"] == "https://test2.foundry.azure.com"
+        assert result["api_key"] == "test-foundry-key"
+        assert result["api_endpoint"] == "https://test.foundry.azure.com"
         
         # Verify session was updated with correct provider and model
-        mock_user_session.set.assert_called_once()
-        set_call = mock_user_session.set.call_args
-        updated_settings = set_call[0][1]
+        updated_settings = fake_session.data["chat_settings"]
         assert updated_settings["model_name"] == "gpt-4.1"
         assert updated_settings["model_provider"] == "foundry"
 
-    @patch('utils.utils.cl.user_session')
     @patch('utils.utils.get_llm_models')
-    def test_get_llm_details_model_not_found(self, mock_get_llm_models, mock_user_session):
+    def test_get_llm_details_model_not_found(self, mock_get_llm_models, sample_llm_models, fake_session):
         """Test get_llm_details when model is not found."""
-        mock_get_llm_models.return_value = self.mock_models
+        mock_get_llm_models.return_value = sample_llm_models
         
         mock_chat_settings = {"temperature": 0.7}
-        mock_user_session.get.side_effect = lambda key, default=None: {
+        fake_session.data.update({
             "chat_settings": mock_chat_settings,
             "chat_profile": "nonexistent/model"
-        }.get(key, default)
+        })
         
         result = get_llm_details()
         
         assert result == {}  # Should return empty dict when not found
 
-    @patch('utils.utils.cl.user_session')
     @patch('utils.utils.get_llm_models')
-    def test_get_llm_details_empty_models_list(self, mock_get_llm_models, mock_user_session):
+    def test_get_llm_details_empty_models_list(self, mock_get_llm_models, fake_session):
         """Test get_llm_details with empty models list."""
         mock_get_llm_models.return_value = []
         
         mock_chat_settings = {"temperature": 0.7}
-        mock_user_session.get.side_effect = lambda key, default=None: {
+        fake_session.data.update({
             "chat_settings": mock_chat_settings,
             "chat_profile": "azure/gpt-4"
-        }.get(key, default)
+        })
         
         result = get_llm_details()
         
         assert result == {}  # Should return empty dict when no models
 
+    @patch('utils.utils.get_llm_models')
+    def test_get_llm_details_lookup_is_cached(self, mock_get_llm_models, sample_llm_models, fake_session):
+        """Test that the model lookup is cached per model name."""
+        mock_get_llm_models.return_value = sample_llm_models
+        fake_session.data.update({
+            "chat_settings": {"temperature": 0.7},
+            "chat_profile": "azure/gpt-4"
+        })
+        
+        first = get_llm_details()
+        second = get_llm_details()
+        
+        assert first is second
+        mock_get_llm_models.assert_called_once()
+
+
+class TestGetDeploymentIndex:
+    """Test cases for get_deployment_index function."""
+    
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        """Each test patches its own model list."""
+        clear_llm_cache()
+
+    @patch('utils.utils.get_llm_models')
+    def test_get_deployment_index_maps_deployments(self, mock_get_llm_models, sample_llm_models):
+        """Test that models are keyed by their full deployment name."""
+        mock_get_llm_models.return_value = sample_llm_models
+        
+        result = get_deployment_index()
+        
+        assert list(result) == [model["model_deployment"] for model in sample_llm_models]
+        assert result["foundry/gpt-4.1"] is sample_llm_models[2]
+
+    @patch('utils.utils.get_llm_models')
+    def test_get_deployment_index_cleared_with_llm_cache(self, mock_get_llm_models, sample_llm_models):
+        """Test that the index is built once and rebuilt after clear_llm_cache()."""
+        mock_get_llm_models.return_value = sample_llm_models
+        
+        assert get_deployment_index() is get_deployment_index()
+        mock_get_llm_models.assert_called_once()
+        
+        clear_llm_cache()
+        get_deployment_index()
+        
+        assert mock_get_llm_models.call_count == 2
+
+
+class TestGetAgentsClient:
+    """Test cases for get_agents_client function."""
+    
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        """Start and end each test without shared Azure clients."""
+        get_agents_client.cache_clear()
+        get_azure_credential.cache_clear()
+        yield
+        get_agents_client.cache_clear()
+        get_azure_credential.cache_clear()
+
+    @patch('azure.identity.DefaultAzureCredential')
+    @patch('azure.ai.agents.AgentsClient')
+    def test_get_agents_client_reused_per_endpoint(self, mock_agents_client, mock_credential):
+        """Test that one client is built per endpoint and all share one credential."""
+        mock_agents_client.side_effect = lambda endpoint, credential: Mock(endpoint=endpoint)
+        
+        first = get_agents_client("https://one.foundry.azure.com")
+        
+        assert get_agents_client("https://one.foundry.azure.com") is first
+        assert get_agents_client("https://two.foundry.azure.com") is not first
+        assert mock_agents_client.call_count == 2
+        mock_credential.assert_called_once_with()
+        mock_agents_client.assert_called_with(
+            endpoint="https://two.foundry.azure.com", credential=mock_credential.return_value
+        )
+
 
 if __name__ == "__main__":
     pytest.main([__file__])
@@ -5,8 +5,33 @@
 import time
 import chainlit as cl
 from loguru import logger
-from litellm import completion
-from utils.utils import get_llm_models
+from litellm import acompletion
+from utils.utils import get_deployment_index, get_elapsed_time
+
+# Streamed tokens are sent to the UI in batches to cut WebSocket frames
+STREAM_FLUSH_TOKENS = 32
+STREAM_FLUSH_INTERVAL = 0.05  # seconds
+
+# Models that reject the temperature parameter
+_NO_TEMPERATURE_MODELS = frozenset({"o3-mini"})
+
+# Function tools offered to the model when use_tools is set (shared, do not mutate)
+_SEARCH_WEB_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "search_web",
+            "description": "Search the web using SERP API",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string", "description": "The search query"}
+                },
+                "required": ["query"]
+            }
+        }
+    }
+]
 
 
 # Get LLM parameters
@@ -32,8 +57,9 @@ def get_llm_params(messages: list, use_tools = False) -> dict:
     model_name = chat_settings.get("model_name")
 
     # Get the model details from the selected model
-    llm_details = next((item for item in get_llm_models() if item["model_deployment"] == chat_profile), {})
-    logger.debug(f"messages: {messages}")
+    llm_details = get_deployment_index().get(chat_profile, {})
+    # Log a summary only: messages may carry large base64 images
+    logger.debug(f"Messages: {len(messages)} ({', '.join(message['role'] for message in messages)})")
 
     chat_parameters = {
         "model": chat_profile,
@@ -45,23 +71,6 @@ def get_llm_params(messages: list, use_tools = False) -> dict:
     if "api_key" in llm_details:
         chat_parameters["api_key"] = llm_details["api_key"]
 
-    tools = [
-        {
-            "type": "function",
-            "function": {
-                "name": "search_web",
-                "description": "Search the web using SERP API",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "query": {"type": "string", "description": "The search query"}
-                    },
-                    "required": ["query"]
-                }
-            }
-        }
-    ]
-
     if provider == "azure":
         if llm_details.get("api_version"):
             chat_parameters["api_version"] = llm_details["api_version"]
@@ -70,14 +79,14 @@ def get_llm_params(messages: list, use_tools = False) -> dict:
             chat_parameters["api_base"] = llm_details["api_endpoint"]
 
         # Models that accept temperature
-        if model_name not in ["o3-mini"]:
+        if model_name not in _NO_TEMPERATURE_MODELS:
             chat_parameters["temperature"] = temperature
     else:
         chat_parameters["temperature"] = float(temperature)
 
     # Append search_web tool
     if use_tools:
-        chat_parameters["tools"] = tools
+        chat_parameters["tools"] = _SEARCH_WEB_TOOLS
 
     return chat_parameters
 
@@ -108,34 +117,59 @@ async def chat_completion(messages: list, use_tools = False) -> str:
         # Show thinking message to user
         msg = await cl.Message(f"[{model_name}] thinking...", author="agent").send()
         chat_parameters = get_llm_params(messages)
-        logger.info(f"Chat parameters: {chat_parameters}")
+        # Messages are left out: get_llm_params already logged their summary
+        logged_parameters = {key: value for key, value in chat_parameters.items() if key != "messages"}
+        logger.debug(f"Chat parameters: {logged_parameters}")
 
-        # Create chat completion
-        response = completion(**chat_parameters)
+        # Create chat completion; the async stream lets other sessions run while tokens arrive
+        response = await acompletion(**chat_parameters)
         is_thinking = True
         last_chunk = None
+        citations = None
+        parts = []  # every delta, joined once after streaming
+        buffer = []  # deltas not yet sent to the UI
+        last_flush = time.monotonic()
+
+        async for chunk in response:
+            last_chunk = chunk
+            # Keep the latest citations; a trailing usage/finish chunk may carry none
+            citations = getattr(chunk, "citations", None) or citations
 
-        for chunk in response:
             # Check if the message is still thinking
             if is_thinking:
                 msg.content = ""
                 is_thinking = False
-                logger.info(f"Elapsed time: {(time.time() - cl.user_session.get('start_time')):.2f} seconds")
-
-            if chunk.choices and chunk.choices[0].delta.content:
-                # await msg.stream_token(chunk.choices[0].delta.content)
-                msg.content += chunk.choices[0].delta.content
-                await msg.update()
-
-            if "citations" in chunk:
-                last_chunk = chunk
-
-        if last_chunk and "citations" in last_chunk:
-            msg.content += f"\n\n**Sources:**"
-
-            # Loop through citations and append them to the response
-            for citation in last_chunk.citations:
-                msg.content += f"\n[{citation}]({citation})"
+                logger.info(f"Elapsed time: {get_elapsed_time():.2f} seconds")
+
+            # Skip chunks without a content delta (e.g. role-only or final chunks)
+            choices = chunk.choices
+            if not choices:
+                continue
+            text = choices[0].delta.content
+            if not text:
+                continue
+
+            parts.append(text)
+            buffer.append(text)
+
+            # Flush buffered deltas every STREAM_FLUSH_TOKENS tokens or STREAM_FLUSH_INTERVAL seconds
+            now = time.monotonic()
+            if len(buffer) >= STREAM_FLUSH_TOKENS or now - last_flush > STREAM_FLUSH_INTERVAL:
+                await msg.stream_token("".join(buffer))
+                buffer.clear()
+                last_flush = now
+
+        # Flush whatever is left in the buffer
+        if buffer:
+            await msg.stream_token("".join(buffer))
+
+        # Build the full response once instead of growing the string per token
+        if not is_thinking:
+            msg.content = "".join(parts)
+
+        if citations:
+            # Append the citations to the response in one concatenation
+            msg.content += "\n\n**Sources:**" + "".join(f"\n[{citation}]({citation})" for citation in citations)
 
         logger.info(f"Last Chunk: {last_chunk}")
 
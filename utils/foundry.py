@@ -3,15 +3,12 @@
 # Supporting advanced capabilities like code interpretation and file processing
 
 import os
-import time
 import urllib.parse
 import chainlit as cl
 from typing import List
 from pathlib import Path
 from loguru import logger
-from azure.ai.agents import AgentsClient
-from azure.identity import DefaultAzureCredential
-from utils.utils import get_llm_models
+from utils.utils import get_agents_client, get_deployment_index, get_elapsed_time
 from azure.ai.agents.models import (
     CodeInterpreterTool,
     MessageAttachment,
@@ -49,18 +46,15 @@ async def chat_agent(user_input: str) -> str:
         chat_settings = cl.user_session.get("chat_settings")
         chat_profile = cl.user_session.get("chat_profile")
         model_name = chat_settings.get("model_name")        # Get the model details from the selected model
-        llm_details = next((item for item in get_llm_models() if item["model_deployment"] == chat_profile), {})
+        llm_details = get_deployment_index().get(chat_profile, {})
         
         # Show thinking message to user
         msg = await cl.Message(f"[{model_name}] thinking...", author="agent").send()
         if not msg:
             raise Exception("Failed to create message object")
 
-        # Create an instance of the AgentsClient using DefaultAzureCredential
-        agents_client = AgentsClient(
-            endpoint=llm_details["api_endpoint"],
-            credential=DefaultAzureCredential()
-        )
+        # Reuse the shared AgentsClient (and DefaultAzureCredential) for this endpoint
+        agents_client = get_agents_client(llm_details["api_endpoint"])
 
         thread_id = cl.user_session.get("thread_id")
         file_uploads = cl.user_session.get("file_uploads", [])
@@ -117,7 +111,7 @@ async def chat_agent(user_input: str) -> str:
                         await msg.update()
 
                     if is_thinking:
-                        logger.info(f"Elapsed time: {(time.time() - cl.user_session.get('start_time')):.2f} seconds")
+                        logger.info(f"Elapsed time: {get_elapsed_time():.2f} seconds")
                         is_thinking = False
 
                 elif isinstance(event_data, ThreadRun):
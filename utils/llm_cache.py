@@ -0,0 +1,490 @@
+# Response cache for BSP AI Assistant
+# This file provides a cache layer consulted before the LLM providers are called,
+# so repeated prompts can be answered without paying model latency and token cost again.
+# Responses are kept in an in-process LRU (L1) and optionally in Redis (L2) so they
+# survive worker restarts and are shared across App Service instances. An optional
+# semantic tier reuses responses for paraphrased prompts via embedding similarity.
+
+import os
+import re
+import asyncio
+import hashlib
+import orjson
+from typing import Awaitable, Callable, Optional, Protocol
+from collections import OrderedDict
+from loguru import logger
+
+# Prompts that depend on the current date/time must never be answered semantically
+TIME_SENSITIVE_PATTERN = re.compile(
+    r"\b(today|now|tonight|yesterday|tomorrow|currently|latest)\b|\d{1,2}:\d{2}|\d{4}-\d{2}-\d{2}",
+    re.IGNORECASE,
+)
+
+
+# Build a cache key from the model and the messages sent to it
+def cache_key(model: str, messages: list) -> str:
+    """
+    Build a deterministic cache key for an LLM request.
+
+    Args:
+        model: The model deployment (chat profile) the request is routed to
+        messages: List of message objects sent to the model
+
+    Returns:
+        str: SHA-256 hex digest of the canonical JSON payload
+    """
+    payload = orjson.dumps({"model": model, "messages": messages}, option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(payload).hexdigest()
+
+
+# Build the semantic-tier partition from everything sent before the latest prompt
+def semantic_namespace(model: str, messages: list) -> str:
+    """
+    Build the semantic-tier namespace for an LLM request.
+
+    Paraphrase matching only compares the latest user prompt, so the namespace
+    pins the rest of the context: the system prompt (session instructions) and
+    every earlier turn, including converted file uploads. Follow-ups such as
+    "summarize the above" therefore only match requests with the same history.
+
+    Args:
+        model: The model deployment (chat profile) the request is routed to
+        messages: List of message objects sent to the model, ending with the user prompt
+
+    Returns:
+        str: The model followed by a hash of the preceding messages
+    """
+    return f"{model}:{cache_key(model, messages[:-1])}"
+
+
+class CacheBackend(Protocol):
+    """Storage interface shared by the cache tiers."""
+
+    async def get(self, key: str) -> Optional[str]:
+        """Return the stored value for `key`, or None if absent."""
+        ...
+
+    async def set(self, key: str, value: str) -> None:
+        """Store `value` under `key`."""
+        ...
+
+    async def delete(self, key: str) -> None:
+        """Remove `key` if present."""
+        ...
+
+
+class MemoryBackend:
+    """
+    In-process LRU backend (L1).
+
+    Entries are evicted in least-recently-used order once `maxsize` is reached.
+    """
+
+    def __init__(self, maxsize: int = 1024) -> None:
+        """
+        Initialize an empty LRU store.
+
+        Args:
+            maxsize: Maximum number of responses to keep (default: 1024)
+        """
+        self.maxsize = maxsize
+        self._store: OrderedDict = OrderedDict()
+
+    async def get(self, key: str) -> Optional[str]:
+        """
+        Look up a value and mark it as recently used.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            Optional[str]: The stored value, or None on a miss
+        """
+        value = self._store.get(key)
+        if value is not None:
+            self._store.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str) -> None:
+        """
+        Store a value, evicting the least recently used entry if full.
+
+        Args:
+            key: Cache key
+            value: Value to store
+        """
+        self._store[key] = value
+        self._store.move_to_end(key)
+        if len(self._store) > self.maxsize:
+            self._store.popitem(last=False)
+
+    async def delete(self, key: str) -> None:
+        """
+        Remove a value from the store.
+
+        Args:
+            key: Cache key
+        """
+        self._store.pop(key, None)
+
+
+class RedisBackend:
+    """
+    Redis backend (L2) shared across workers and App Service instances.
+    """
+
+    def __init__(self, url: str, ttl: int = 3600) -> None:
+        """
+        Create a Redis client for the given URL.
+
+        Args:
+            url: Redis connection URL (e.g. rediss://:<key>@<host>:6380/0)
+            ttl: Expiry in seconds for stored responses (default: 3600)
+        """
+        # Imported here so redis is only required when an L2 is configured
+        import redis.asyncio as redis
+
+        self.ttl = ttl
+        self._redis = redis.Redis.from_url(url)
+
+    async def get(self, key: str) -> Optional[str]:
+        """
+        Look up a value in Redis.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            Optional[str]: The stored value, or None on a miss
+        """
+        raw = await self._redis.get(key)
+        return orjson.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value: str) -> None:
+        """
+        Store a value in Redis with the configured TTL.
+
+        Args:
+            key: Cache key
+            value: Value to store
+        """
+        await self._redis.set(key, orjson.dumps(value), ex=self.ttl)
+
+    async def delete(self, key: str) -> None:
+        """
+        Remove a value from Redis.
+
+        Args:
+            key: Cache key
+        """
+        await self._redis.delete(key)
+
+
+class SemanticIndex:
+    """
+    Embedding index of previously answered prompts for one model deployment.
+
+    Vectors are L2-normalized so the inner product is the cosine similarity.
+    Storage is a preallocated ring buffer: it grows by doubling up to
+    `max_entries`, after which the oldest entries are overwritten.
+    """
+
+    def __init__(self, max_entries: int = 10000) -> None:
+        """
+        Initialize an empty index.
+
+        Args:
+            max_entries: Maximum number of prompts to keep (oldest are dropped first)
+        """
+        # Imported here so numpy is only required when the semantic tier is enabled
+        import numpy as np
+
+        self._np = np
+        self.max_entries = max_entries
+        self._vectors = None
+        self._responses: list = []
+        self._size = 0
+        self._next = 0
+
+    def search(self, vector) -> tuple:
+        """
+        Find the most similar stored prompt.
+
+        Args:
+            vector: Normalized query embedding
+
+        Returns:
+            tuple: (similarity, response) of the best match, or (0.0, None) when empty
+        """
+        if self._size == 0:
+            return 0.0, None
+
+        similarities = self._vectors[:self._size] @ vector
+        best = int(similarities.argmax())
+        return float(similarities[best]), self._responses[best]
+
+    def add(self, vector, response: str) -> None:
+        """
+        Add a prompt embedding and its response to the index.
+
+        Args:
+            vector: Normalized prompt embedding
+            response: The LLM response for the prompt
+        """
+        if self._vectors is None:
+            self._vectors = self._np.empty((min(16, self.max_entries), vector.shape[0]), dtype=self._np.float32)
+        elif self._size == len(self._vectors) < self.max_entries:
+            grown = self._np.empty((min(2 * self._size, self.max_entries), vector.shape[0]), dtype=self._np.float32)
+            grown[:self._size] = self._vectors
+            self._vectors = grown
+
+        self._vectors[self._next] = vector
+        if self._size < len(self._vectors):
+            self._responses.append(response)
+            self._size += 1
+        else:
+            self._responses[self._next] = response
+        self._next = (self._next + 1) % len(self._vectors) if self._size == self.max_entries else self._size
+
+
+class LLMCache:
+    """
+    Read-through / write-through cache of LLM responses.
+
+    Lookups go L1 -> L2 -> semantic -> miss; an L2 hit is copied into L1 so the
+    next lookup for the same prompt stays in-process. The semantic tier is only
+    consulted when an embedding model is configured.
+    """
+
+    def __init__(
+        self,
+        l1: Optional[CacheBackend] = None,
+        l2: Optional[CacheBackend] = None,
+        embedding_model: Optional[str] = None,
+        similarity_threshold: float = 0.95,
+        max_namespaces: int = 1024,
+    ) -> None:
+        """
+        Initialize the cache tiers.
+
+        Args:
+            l1: In-process backend (default: a new MemoryBackend)
+            l2: Optional shared backend such as RedisBackend
+            embedding_model: LiteLLM embedding model for the semantic tier (default: disabled)
+            similarity_threshold: Minimum cosine similarity for a semantic hit (default: 0.95)
+            max_namespaces: Maximum semantic indexes to keep, least recently used dropped first (default: 1024)
+        """
+        self.l1 = l1 if l1 is not None else MemoryBackend()
+        self.l2 = l2
+        self.embedding_model = embedding_model
+        self.similarity_threshold = similarity_threshold
+        self.max_namespaces = max_namespaces
+        self._indexes: OrderedDict = OrderedDict()
+        self._pending_vectors: OrderedDict = OrderedDict()
+        self._inflight: dict = {}
+
+    async def _embed(self, text: str):
+        """
+        Embed a prompt with the configured embedding model.
+
+        Args:
+            text: The prompt to embed
+
+        Returns:
+            The L2-normalized embedding vector
+        """
+        import numpy as np
+        from litellm import aembedding
+
+        response = await aembedding(model=self.embedding_model, input=[text])
+        vector = np.asarray(response.data[0]["embedding"], dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def _use_semantic(self, prompt: Optional[str]) -> bool:
+        """
+        Check whether the semantic tier applies to a prompt.
+
+        Args:
+            prompt: The raw user prompt
+
+        Returns:
+            bool: True if semantic lookup is enabled and the prompt is not time sensitive
+        """
+        return bool(self.embedding_model and prompt and not TIME_SENSITIVE_PATTERN.search(prompt))
+
+    async def get(self, key: str, prompt: Optional[str] = None, namespace: str = "") -> Optional[str]:
+        """
+        Look up a cached response.
+
+        Args:
+            key: Cache key produced by `cache_key`
+            prompt: The raw user prompt, used for the semantic tier (optional)
+            namespace: Partition for semantic matches, built by `semantic_namespace`
+
+        Returns:
+            Optional[str]: The cached response, or None on a miss
+        """
+        value = await self.l1.get(key)
+        if value is not None:
+            logger.info(f"LLM cache HIT (L1): {key[:12]}")
+            return value
+
+        if self.l2 is not None:
+            try:
+                value = await self.l2.get(key)
+            except Exception as e:
+                logger.error(f"LLM cache L2 lookup failed: {str(e)}")
+                value = None
+
+            if value is not None:
+                await self.l1.set(key, value)
+                logger.info(f"LLM cache HIT (L2): {key[:12]}")
+                return value
+
+        if self._use_semantic(prompt):
+            try:
+                vector = await self._embed(prompt)
+                index = self._indexes.get(namespace)
+                if index is not None:
+                    self._indexes.move_to_end(namespace)
+                similarity, value = index.search(vector) if index else (0.0, None)
+
+                if value is not None and similarity >= self.similarity_threshold:
+                    logger.info(f"LLM cache HIT (semantic {similarity:.3f}): {key[:12]}")
+                    return value
+
+                # Keep the embedding so `set` does not have to compute it again
+                self._pending_vectors[key] = vector
+                if len(self._pending_vectors) > 256:
+                    self._pending_vectors.popitem(last=False)
+            except Exception as e:
+                logger.error(f"LLM cache semantic lookup failed: {str(e)}")
+
+        logger.info(f"LLM cache MISS: {key[:12]}")
+        return None
+
+    async def set(self, key: str, value: str, prompt: Optional[str] = None, namespace: str = "") -> None:
+        """
+        Store a response in every cache tier.
+
+        Args:
+            key: Cache key produced by `cache_key`
+            value: The full LLM response text
+            prompt: The raw user prompt, used for the semantic tier (optional)
+            namespace: Partition for semantic matches, built by `semantic_namespace`
+        """
+        await self.l1.set(key, value)
+        if self.l2 is not None:
+            try:
+                await self.l2.set(key, value)
+            except Exception as e:
+                logger.error(f"LLM cache L2 write failed: {str(e)}")
+
+        vector = self._pending_vectors.pop(key, None)
+        if vector is None and self._use_semantic(prompt):
+            try:
+                vector = await self._embed(prompt)
+            except Exception as e:
+                logger.error(f"LLM cache semantic write failed: {str(e)}")
+
+        if vector is not None:
+            if namespace not in self._indexes:
+                self._indexes[namespace] = SemanticIndex()
+                if len(self._indexes) > self.max_namespaces:
+                    self._indexes.popitem(last=False)
+            self._indexes.move_to_end(namespace)
+            try:
+                self._indexes[namespace].add(vector, value)
+            except Exception as e:
+                # e.g. the embedding dimension changed; the exact-match tiers still hold the response
+                logger.warning(f"LLM cache semantic indexing skipped: {str(e)}")
+
+    async def coalesce(self, key: str, factory: Callable[[], Awaitable[str]]) -> tuple:
+        """
+        Run `factory` once for concurrent requests sharing the same key.
+
+        The first caller (the leader) runs the factory; callers arriving while
+        it is in flight await the leader's result instead of issuing their own
+        LLM request. Failures are propagated to every waiter. Cancelling a waiter
+        does not affect the leader; cancelling the leader raises RuntimeError in
+        the waiters.
+
+        Args:
+            key: Cache key produced by `cache_key`
+            factory: Coroutine function producing the response
+
+        Returns:
+            tuple: (response, shared) where shared is True if the response came from another request
+        """
+        future = self._inflight.get(key)
+        if future is not None:
+            logger.info(f"LLM request coalesced: {key[:12]}")
+            # Shielded so a cancelled waiter (user pressed stop) does not cancel the shared future
+            return await asyncio.shield(future), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await factory()
+            if not future.done():
+                future.set_result(result)
+            return result, False
+        except asyncio.CancelledError:
+            # Waiters were not cancelled themselves, so give them an error they can report
+            self._fail(future, RuntimeError("The shared LLM request was cancelled"))
+            raise
+        except BaseException as e:
+            self._fail(future, e)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    @staticmethod
+    def _fail(future: asyncio.Future, error: BaseException) -> None:
+        """
+        Propagate a leader failure to the waiters of an in-flight request.
+
+        Args:
+            future: The shared future awaited by the waiters
+            error: The exception to raise in every waiter
+        """
+        if not future.done():
+            future.set_exception(error)
+            future.exception()  # Mark retrieved so asyncio does not warn when there are no waiters
+
+    async def delete(self, key: str) -> None:
+        """
+        Remove a response from the exact-match cache tiers.
+
+        Args:
+            key: Cache key produced by `cache_key`
+        """
+        await self.l1.delete(key)
+        if self.l2 is not None:
+            await self.l2.delete(key)
+
+
+# Create the response cache from environment configuration
+def create_llm_cache() -> LLMCache:
+    """
+    Build the response cache, adding a Redis L2 when `REDIS_URL` is set.
+
+    Environment:
+        REDIS_URL: Redis connection URL for the shared L2 (optional)
+        LLM_CACHE_TTL: L2 expiry in seconds (default: 3600)
+        LLM_CACHE_SIZE: Maximum L1 entries per process (default: 1024)
+        LLM_CACHE_EMBEDDING_MODEL: LiteLLM embedding model enabling the semantic tier (optional)
+        LLM_CACHE_SIMILARITY: Minimum cosine similarity for a semantic hit (default: 0.95)
+
+    Returns:
+        LLMCache: The configured cache
+    """
+    l1 = MemoryBackend(maxsize=int(os.getenv("LLM_CACHE_SIZE", "1024")))
+    redis_url = os.getenv("REDIS_URL")
+    l2 = RedisBackend(redis_url, ttl=int(os.getenv("LLM_CACHE_TTL", "3600"))) if redis_url else None
+    return LLMCache(
+        l1=l1,
+        l2=l2,
+        embedding_model=os.getenv("LLM_CACHE_EMBEDDING_MODEL") or None,
+        similarity_threshold=float(os.getenv("LLM_CACHE_SIMILARITY", "0.95")),
+    )
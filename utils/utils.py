@@ -2,13 +2,20 @@
 # This file contains core utilities for session management, logging configuration,
 # message formatting, model configuration, and chat settings initialization
 
-import os, sys, json, base64, logging
+import os, sys, json, time, base64, logging, functools
+from contextvars import ContextVar
+from typing import TYPE_CHECKING
 import chainlit as cl
 from loguru import logger
 from dotenv import load_dotenv
 from markitdown import MarkItDown
 from chainlit.input_widget import Slider, TextInput
 
+# The Azure SDKs are imported lazily, only when a Foundry profile is used
+if TYPE_CHECKING:
+    from azure.ai.agents import AgentsClient
+    from azure.identity import DefaultAzureCredential
+
 # Load environment variables
 load_dotenv()
 md = MarkItDown()
@@ -118,14 +125,30 @@ logger.add(
 # Expose logger
 get_logger = lambda: logger
 
+# Monotonic start time (ns) of the message being handled, scoped to the current task
+request_start_ns: ContextVar[int] = ContextVar("request_start_ns", default=0)
+
+
+# Seconds elapsed since the current message started processing
+def get_elapsed_time() -> float:
+    """
+    Compute the time elapsed since the current message was received.
+    
+    Returns:
+        float: Elapsed time in seconds, measured with a monotonic clock
+    """
+    return (time.monotonic_ns() - request_start_ns.get()) / 1e9
+
 
 # Get llm models from llm_config.json
+@functools.lru_cache(maxsize=1)
 def get_llm_models() -> list:
     """
     Retrieve the list of available LLM models from the configuration.
     
     Loads model configurations either from environment variable (production)
-    or from the configuration file (development).
+    or from the configuration file (development). The result is cached for the
+    life of the process; call `clear_llm_cache()` to reload.
     
     Returns:
         list: List of LLM model configuration dictionaries
@@ -311,5 +334,77 @@ def get_llm_details() -> dict:
     chat_settings["model_provider"] = provider
     cl.user_session.set("chat_settings", chat_settings)
 
-    llm_details = next((item for item in get_llm_models() if item["model_deployment"].endswith(f"/{model_name}")), {})
-    return llm_details
+    return find_llm_details(model_name)
+
+
+# Find the configuration of a model by name
+@functools.lru_cache(maxsize=None)
+def find_llm_details(model_name: str) -> dict:
+    """
+    Look up the configuration of a model by its name.
+    
+    Results are cached per model name since the configuration does not change
+    while the process is running; call `clear_llm_cache()` to reload.
+    
+    Args:
+        model_name: Model name without the provider prefix (e.g. 'gpt-4')
+        
+    Returns:
+        dict: Model configuration details, or an empty dict if not found
+    """
+    return next((item for item in get_llm_models() if item["model_deployment"].endswith(f"/{model_name}")), {})
+
+
+# Index the model configurations by deployment
+@functools.lru_cache(maxsize=1)
+def get_deployment_index() -> dict:
+    """
+    Map each model deployment (e.g. 'azure/gpt-4') to its configuration.
+    
+    Built once from `get_llm_models()` so callers can look up the selected
+    chat profile in constant time; call `clear_llm_cache()` to reload.
+    
+    Returns:
+        dict: Model configuration dictionaries keyed by model_deployment
+    """
+    return {item["model_deployment"]: item for item in get_llm_models()}
+
+
+# Share one Azure credential across sessions
+@functools.lru_cache(maxsize=1)
+def get_azure_credential() -> "DefaultAzureCredential":
+    """
+    Return the process-wide DefaultAzureCredential, creating it on first use.
+    
+    Reusing the credential lets its token cache survive across messages
+    instead of acquiring a new token for every Foundry request.
+    
+    Returns:
+        DefaultAzureCredential: The shared credential
+    """
+    from azure.identity import DefaultAzureCredential
+    return DefaultAzureCredential()
+
+
+# Share one AgentsClient per Foundry endpoint across sessions
+@functools.lru_cache(maxsize=None)
+def get_agents_client(endpoint: str) -> "AgentsClient":
+    """
+    Return the shared AgentsClient for an endpoint, creating it on first use.
+    
+    Args:
+        endpoint: Azure AI Foundry project endpoint
+        
+    Returns:
+        AgentsClient: Client reused by every session targeting this endpoint
+    """
+    from azure.ai.agents import AgentsClient
+    return AgentsClient(endpoint=endpoint, credential=get_azure_credential())
+
+
+# Clear cached model configuration
+def clear_llm_cache() -> None:
+    """Clear the cached model configuration so it is reloaded on next use."""
+    get_llm_models.cache_clear()
+    find_llm_details.cache_clear()
+    get_deployment_index.cache_clear()